@@ -1,30 +1,74 @@
+import csv
+import json
 import os
-import pyodbc
+import sqlite3
+import sys
+import time
 from dotenv import load_dotenv
 
 load_dotenv()
 
-server = os.getenv("server").strip()
-database = os.getenv("database").strip()
-sql_username = os.getenv("sql_username").strip()
-password = os.getenv("password").strip()
-driver = os.getenv("driver").strip()
+# Rows per batch sent to the database; each batch is committed on its own
+LOAD_BATCH_SIZE = int(os.getenv("LOAD_BATCH_SIZE", "5000"))
+# Set to load into a SQLite file instead of Azure SQL (useful for local runs)
+CANDIDATES_SQLITE_PATH = os.getenv("CANDIDATES_SQLITE_PATH")
 
-print(f"Server: {server}")
-print(f"Database: {database}")
-print(f"Username: {sql_username}")
-print(f"Driver: {driver}")
-print(f"Password length: {len(password)}")
+COLUMNS = ("name", "status", "email", "location")
 
-connection_string = f"Driver={driver};Server={server};Database={database};Uid={sql_username};Pwd={password};Encrypt=yes;TrustServerCertificate=no;Connection Timeout=30;"
+# Loaded when no CSV/JSONL file is given
+SEED_CANDIDATES = [
+    ('Bob Smith', 'Applied', 'bob.smith@example.com', 'Vancouver'),
+    ('Charlie Lee', 'Interviewed', 'charlie.lee@example.com', 'Montreal'),
+    ('Diana Prince', 'Hired', 'diana.prince@example.com', 'Calgary'),
+    ('Ethan Hunt', 'Applied', 'ethan.hunt@example.com', 'Ottawa'),
+    ('Fiona Gallagher', 'Rejected', 'fiona.gallagher@example.com', 'Halifax'),
+    ('George Martin', 'Interviewed', 'george.martin@example.com', 'Edmonton'),
+    ('Hannah Brown', 'Applied', 'hannah.brown@example.com', 'Winnipeg'),
+    ('Ian Curtis', 'Hired', 'ian.curtis@example.com', 'Quebec City'),
+    ('Jessica Jones', 'Interviewed', 'jessica.jones@example.com', 'Victoria'),
+]
+
+
+# --- Reading candidates ---
+def read_candidates(path):
+    """
+    Streams (name, status, email, location) tuples from a CSV file with a
+    header row or a JSONL file with one object per line. Emails are the upsert
+    key, so they are normalized and rows without one are skipped.
+    """
+    with open(path, newline="", encoding="utf-8") as f:
+        if path.lower().endswith((".jsonl", ".ndjson")):
+            records = (json.loads(line) for line in f if line.strip())
+        else:
+            records = csv.DictReader(f)
+        for record in records:
+            row = normalize_row(tuple(record.get(column) for column in COLUMNS))
+            if row:
+                yield row
+
+
+def normalize_row(row):
+    name, status, email, location = (str(v).strip() if v is not None else None for v in row)
+    if not email:
+        return None
+    return (name or None, status or None, email.lower(), location or None)
 
-try:
-    conn = pyodbc.connect(connection_string)
-    cursor = conn.cursor()
-    print("Connection successful!")
 
-    # Create table (if not exists - you might want to add a check or drop table before creating)
-    cursor.execute('''
+def batched(rows, size):
+    batch = {}
+    for row in rows:
+        # Last row wins for an email repeated within a batch
+        batch[row[2]] = row
+        if len(batch) >= size:
+            yield list(batch.values())
+            batch = {}
+    if batch:
+        yield list(batch.values())
+
+
+# --- Schema ---
+SQLSERVER_SCHEMA = [
+    '''
     IF OBJECT_ID('dbo.candidates', 'U') IS NULL
     BEGIN
         CREATE TABLE candidates (
@@ -35,34 +79,192 @@ try:
             location NVARCHAR(100)
         )
     END
-    ''')
-    conn.commit()
+    ''',
+    # The upsert key is unique. Tables loaded by the old insert-only script
+    # keep their first row per email; later copies are deleted first.
+    '''
+    IF NOT EXISTS (SELECT 1 FROM sys.indexes WHERE name = 'ux_candidates_email'
+                   AND object_id = OBJECT_ID('dbo.candidates'))
+    BEGIN
+        DELETE FROM candidates WHERE candidate_id IN (
+            SELECT candidate_id FROM (
+                SELECT candidate_id,
+                       ROW_NUMBER() OVER (PARTITION BY email ORDER BY candidate_id) AS n
+                FROM candidates
+                WHERE email IS NOT NULL
+            ) AS ranked
+            WHERE n > 1
+        );
+        IF EXISTS (SELECT 1 FROM sys.indexes WHERE name = 'ix_candidates_email'
+                   AND object_id = OBJECT_ID('dbo.candidates'))
+            DROP INDEX ix_candidates_email ON candidates;
+        CREATE UNIQUE INDEX ux_candidates_email ON candidates (email) WHERE email IS NOT NULL;
+    END
+    ''',
+    *(
+        f'''
+        IF NOT EXISTS (SELECT 1 FROM sys.indexes WHERE name = 'ix_candidates_{column}'
+                       AND object_id = OBJECT_ID('dbo.candidates'))
+            CREATE INDEX ix_candidates_{column} ON candidates ({column})
+        '''
+        for column in ("name", "status", "location")
+    ),
+]
 
-    # List of 10 candidate records (name, status, email, location)
-    candidates_data = [        
-        ('Bob Smith', 'Applied', 'bob.smith@example.com', 'Vancouver'),
-        ('Charlie Lee', 'Interviewed', 'charlie.lee@example.com', 'Montreal'),
-        ('Diana Prince', 'Hired', 'diana.prince@example.com', 'Calgary'),
-        ('Ethan Hunt', 'Applied', 'ethan.hunt@example.com', 'Ottawa'),
-        ('Fiona Gallagher', 'Rejected', 'fiona.gallagher@example.com', 'Halifax'),
-        ('George Martin', 'Interviewed', 'george.martin@example.com', 'Edmonton'),
-        ('Hannah Brown', 'Applied', 'hannah.brown@example.com', 'Winnipeg'),
-        ('Ian Curtis', 'Hired', 'ian.curtis@example.com', 'Quebec City'),
-        ('Jessica Jones', 'Interviewed', 'jessica.jones@example.com', 'Victoria'),
-    ]
-
-    # Insert multiple rows using executemany
-    insert_query = '''
-    INSERT INTO candidates (name, status, email, location)
-    VALUES (?, ?, ?, ?)
+SQLITE_SCHEMA = [
     '''
-    cursor.executemany(insert_query, candidates_data)
+    CREATE TABLE IF NOT EXISTS candidates (
+        candidate_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT,
+        status TEXT,
+        email TEXT,
+        location TEXT
+    )
+    ''',
+    # ON CONFLICT(email) needs a unique index on the key; as on SQL Server,
+    # only the first row per email is kept from tables loaded without one
+    '''
+    DELETE FROM candidates
+    WHERE email IS NOT NULL AND candidate_id NOT IN (
+        SELECT MIN(candidate_id) FROM candidates WHERE email IS NOT NULL GROUP BY email
+    )
+    AND NOT EXISTS (SELECT 1 FROM sqlite_master WHERE name = 'ux_candidates_email')
+    ''',
+    "CREATE UNIQUE INDEX IF NOT EXISTS ux_candidates_email ON candidates (email)",
+    *(
+        f"CREATE INDEX IF NOT EXISTS ix_candidates_{column} ON candidates ({column})"
+        for column in ("name", "status", "location")
+    ),
+]
+
+
+def create_schema(conn):
+    cursor = conn.cursor()
+    for statement in SQLITE_SCHEMA if is_sqlite(conn) else SQLSERVER_SCHEMA:
+        cursor.execute(statement)
     conn.commit()
 
-    print("Inserted 10 candidates successfully.")
 
-    cursor.close()
-    conn.close()
-except Exception as e:
-    print(f"Error: {e}")
+def is_sqlite(conn) -> bool:
+    return isinstance(conn, sqlite3.Connection)
+
+
+# --- Upserts ---
+SQLITE_UPSERT = '''
+INSERT INTO candidates (name, status, email, location)
+VALUES (?, ?, ?, ?)
+ON CONFLICT(email) DO UPDATE SET
+    name = excluded.name,
+    status = excluded.status,
+    location = excluded.location
+'''
 
+# Batches go into a session-scoped staging table, then one MERGE per batch.
+# HOLDLOCK keeps concurrent loads from both inserting the same new email.
+SQLSERVER_STAGE = '''
+IF OBJECT_ID('tempdb..#candidates_stage') IS NULL
+    CREATE TABLE #candidates_stage (
+        name NVARCHAR(100),
+        status NVARCHAR(50),
+        email NVARCHAR(100) NOT NULL PRIMARY KEY,
+        location NVARCHAR(100)
+    )
+'''
+SQLSERVER_STAGE_INSERT = "INSERT INTO #candidates_stage (name, status, email, location) VALUES (?, ?, ?, ?)"
+SQLSERVER_MERGE = '''
+MERGE candidates WITH (HOLDLOCK) AS target
+USING #candidates_stage AS source
+ON target.email = source.email
+WHEN MATCHED AND (
+    EXISTS (SELECT target.name, target.status, target.location
+            EXCEPT SELECT source.name, source.status, source.location)
+) THEN UPDATE SET
+    name = source.name,
+    status = source.status,
+    location = source.location
+WHEN NOT MATCHED BY TARGET THEN
+    INSERT (name, status, email, location)
+    VALUES (source.name, source.status, source.email, source.location);
+'''
+
+
+def upsert_batch(conn, batch):
+    cursor = conn.cursor()
+    if is_sqlite(conn):
+        cursor.executemany(SQLITE_UPSERT, batch)
+    else:
+        cursor.execute(SQLSERVER_STAGE)
+        cursor.execute("TRUNCATE TABLE #candidates_stage")
+        cursor.fast_executemany = True
+        cursor.executemany(SQLSERVER_STAGE_INSERT, batch)
+        cursor.execute(SQLSERVER_MERGE)
+    conn.commit()
+
+
+def load_candidates(conn, rows, batch_size=LOAD_BATCH_SIZE, progress=True):
+    """
+    Upserts candidate rows by email in batches and creates the table and its
+    indexes first if needed. Running it again with the same input changes
+    nothing. Returns {"rows", "batches", "seconds", "rows_per_sec"}.
+    """
+    create_schema(conn)
+    start = time.perf_counter()
+    total = 0
+    batches = 0
+    for batch in batched(rows, batch_size):
+        upsert_batch(conn, batch)
+        total += len(batch)
+        batches += 1
+        elapsed = time.perf_counter() - start
+        if progress:
+            print(f"Batch {batches}: {total} rows, {total / elapsed if elapsed else 0:.0f} rows/s")
+
+    elapsed = time.perf_counter() - start
+    return {
+        "rows": total,
+        "batches": batches,
+        "seconds": elapsed,
+        "rows_per_sec": total / elapsed if elapsed else 0.0,
+    }
+
+
+# --- Connections ---
+def connect():
+    if CANDIDATES_SQLITE_PATH:
+        print(f"SQLite database: {CANDIDATES_SQLITE_PATH}")
+        return sqlite3.connect(CANDIDATES_SQLITE_PATH)
+
+    import pyodbc
+
+    server = os.getenv("server").strip()
+    database = os.getenv("database").strip()
+    sql_username = os.getenv("sql_username").strip()
+    password = os.getenv("password").strip()
+    driver = os.getenv("driver").strip()
+
+    print(f"Server: {server}")
+    print(f"Database: {database}")
+    print(f"Username: {sql_username}")
+    print(f"Driver: {driver}")
+    print(f"Password length: {len(password)}")
+
+    connection_string = f"Driver={driver};Server={server};Database={database};Uid={sql_username};Pwd={password};Encrypt=yes;TrustServerCertificate=no;Connection Timeout=30;"
+    return pyodbc.connect(connection_string)
+
+
+if __name__ == "__main__":
+    # Usage: python SQL_Insert_candidates_data_.py [candidates.csv | candidates.jsonl]
+    source = sys.argv[1] if len(sys.argv) > 1 else os.getenv("CANDIDATES_FILE")
+    rows = read_candidates(source) if source else (normalize_row(row) for row in SEED_CANDIDATES)
+
+    try:
+        conn = connect()
+        print("Connection successful!")
+        stats = load_candidates(conn, rows)
+        conn.close()
+        print(
+            f"Upserted {stats['rows']} candidates in {stats['batches']} batches, "
+            f"{stats['seconds']:.2f}s ({stats['rows_per_sec']:.0f} rows/s)."
+        )
+    except Exception as e:
+        print(f"Error: {e}")
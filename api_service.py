@@ -0,0 +1,239 @@
+import asyncio
+import json
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from dotenv import load_dotenv
+
+import clients
+from llm_cache import normalize_query
+import pipeline
+import tracing
+
+
+class Overloaded(Exception):
+    """Raised when the request queue is full and a query is shed."""
+
+
+class QueryService:
+    """
+    Runs pipeline queries for the HTTP handlers.
+
+    The pipeline's clients are blocking, so queries run on a pool of `workers`
+    threads and the event loop only awaits them. Identical queries (after
+    normalization) or page requests that arrive while one is in flight share
+    its result. At most workers + max_queue distinct queries are admitted;
+    beyond that new ones are shed with Overloaded instead of queueing
+    without bound.
+    """
+
+    def __init__(self, workers=8, max_queue=64, latency_window=1000):
+        self.workers = workers
+        self.max_queue = max_queue
+        self._executor = ThreadPoolExecutor(max_workers=workers)
+        self._inflight = {}  # normalized query -> asyncio future
+        self._latencies = deque(maxlen=latency_window)
+        self._stats_lock = threading.Lock()  # worker threads update the query counters
+
+        self.requests = 0
+        self.completed = 0
+        self.failed = 0
+        self.coalesced = 0
+        self.shed = 0
+
+    @property
+    def queued(self):
+        return max(len(self._inflight) - self.workers, 0)
+
+    async def search(self, query):
+        return await self._submit(("search", normalize_query(query)), self._search, query)
+
+    async def more(self, cursor):
+        """The page after a result's cursor, as {"results": [...], "cursor": ...}."""
+        return await self._submit(("more", json.dumps(cursor, sort_keys=True)), self._more, cursor)
+
+    async def _submit(self, key, work, arg):
+        self.requests += 1
+        future = self._inflight.get(key)
+        if future is not None:
+            self.coalesced += 1
+        else:
+            if len(self._inflight) >= self.workers + self.max_queue:
+                self.shed += 1
+                raise Overloaded()
+            loop = asyncio.get_running_loop()
+            future = loop.run_in_executor(self._executor, self._run, work, arg)
+            self._inflight[key] = future
+            # Dropped when done, not when the first caller leaves, so later
+            # callers keep coalescing onto it even if that caller disconnects
+            future.add_done_callback(lambda _: self._inflight.pop(key, None))
+
+        # Shielded: one caller being cancelled must not cancel the shared query
+        return await asyncio.shield(future)
+
+    def _search(self, query):
+        return pipeline.result_record(pipeline.run_query(query))
+
+    def _more(self, cursor):
+        page = pipeline.next_page(cursor)
+        return {"results": list(page), "cursor": getattr(page, "cursor", None)}
+
+    def _run(self, work, arg):
+        start = time.perf_counter()
+        try:
+            record = work(arg)
+        except Exception:
+            with self._stats_lock:
+                self.failed += 1
+            raise
+        with self._stats_lock:
+            self.completed += 1
+            self._latencies.append(time.perf_counter() - start)
+        return record
+
+    def metrics(self):
+        """Prometheus text exposition of the service, cache, snapshot and SQL pool counters."""
+        lines = [
+            "# TYPE candidate_search_requests_total counter",
+            f"candidate_search_requests_total {self.requests}",
+            "# TYPE candidate_search_queries_total counter",
+            f'candidate_search_queries_total{{status="ok"}} {self.completed}',
+            f'candidate_search_queries_total{{status="error"}} {self.failed}',
+            "# TYPE candidate_search_coalesced_total counter",
+            f"candidate_search_coalesced_total {self.coalesced}",
+            "# TYPE candidate_search_shed_total counter",
+            f"candidate_search_shed_total {self.shed}",
+            "# TYPE candidate_search_inflight gauge",
+            f"candidate_search_inflight {len(self._inflight)}",
+            "# TYPE candidate_search_queued gauge",
+            f"candidate_search_queued {self.queued}",
+        ]
+        with self._stats_lock:
+            latencies = sorted(self._latencies)
+        lines.append("# TYPE candidate_search_latency_seconds summary")
+        for quantile in (0.5, 0.95, 0.99):
+            value = latencies[min(int(quantile * len(latencies)), len(latencies) - 1)] if latencies else 0.0
+            lines.append(f'candidate_search_latency_seconds{{quantile="{quantile}"}} {value:.6f}')
+        lines.append(f"candidate_search_latency_seconds_sum {sum(latencies):.6f}")
+        lines.append(f"candidate_search_latency_seconds_count {len(latencies)}")
+
+        if pipeline.llm_cache is not None:
+            for key, value in pipeline.llm_cache.stats().items():
+                lines.append(f"candidate_search_llm_cache_{key} {value}")
+        if pipeline.sql_pool is not None:
+            for key, value in pipeline.sql_pool.stats().items():
+                lines.append(f"candidate_search_sql_pool_{key} {value}")
+        if pipeline.embedding_cache is not None:
+            for key, value in pipeline.embedding_cache.stats().items():
+                if key != "dtype":
+                    lines.append(f"candidate_search_embedding_cache_{key} {value}")
+        if pipeline.candidate_snapshot is not None:
+            for key, value in pipeline.candidate_snapshot.stats().items():
+                lines.append(f"candidate_search_snapshot_{key} {value}")
+        return "\n".join(lines) + "\n"
+
+    def close(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+# --- HTTP ---
+def make_app(service):
+    """
+    aiohttp application with:
+      POST /search {"query": "..."} (or GET /search?q=...) -> pipeline result
+      POST /search/more {"cursor": <sql_cursor or vector_cursor>} -> next page
+      GET /metrics -> Prometheus text
+      GET /healthz
+    Shed requests get 503 with Retry-After.
+    """
+    from aiohttp import web
+
+    async def search(request):
+        if request.method == "POST":
+            try:
+                body = await request.json()
+            except ValueError:
+                return web.json_response({"error": "Body must be JSON"}, status=400)
+            query = body.get("query") if isinstance(body, dict) else None
+        else:
+            query = request.query.get("q")
+        if not isinstance(query, str) or not query.strip():
+            return web.json_response({"error": "Missing query"}, status=400)
+
+        try:
+            record = await service.search(query.strip())
+        except Overloaded:
+            return web.json_response(
+                {"error": "Too many queries in flight, try again shortly"},
+                status=503, headers={"Retry-After": "1"},
+            )
+        except Exception as e:
+            return web.json_response({"error": f"{type(e).__name__}: {e}"}, status=500)
+        # SQL rows can hold decimals and dates
+        return web.json_response(record, dumps=lambda data: json.dumps(data, default=str))
+
+    async def more(request):
+        try:
+            body = await request.json()
+        except ValueError:
+            return web.json_response({"error": "Body must be JSON"}, status=400)
+        cursor = body.get("cursor") if isinstance(body, dict) else None
+        if not isinstance(cursor, dict):
+            return web.json_response({"error": "Missing cursor"}, status=400)
+
+        try:
+            page = await service.more(cursor)
+        except Overloaded:
+            return web.json_response(
+                {"error": "Too many queries in flight, try again shortly"},
+                status=503, headers={"Retry-After": "1"},
+            )
+        except ValueError as e:
+            return web.json_response({"error": str(e)}, status=400)
+        except Exception as e:
+            return web.json_response({"error": f"{type(e).__name__}: {e}"}, status=500)
+        return web.json_response(page, dumps=lambda data: json.dumps(data, default=str))
+
+    async def metrics(request):
+        return web.Response(text=service.metrics(), content_type="text/plain")
+
+    async def healthz(request):
+        return web.Response(text="ok")
+
+    async def shutdown(app):
+        service.close()
+
+    app = web.Application()
+    app.router.add_route("GET", "/search", search)
+    app.router.add_route("POST", "/search", search)
+    app.router.add_post("/search/more", more)
+    app.router.add_get("/metrics", metrics)
+    app.router.add_get("/healthz", healthz)
+    app.on_shutdown.append(shutdown)
+    return app
+
+
+def main():
+    from aiohttp import web
+
+    load_dotenv()
+    tracing.configure(
+        os.getenv("TRACE_LOG_PATH") or None,
+        os.getenv("TRACE_FORMAT", "jsonl").strip().lower(),
+    )
+    workers = int(os.getenv("API_WORKERS", "8"))
+    # One connection per worker, plus one for candidate rows refreshes
+    clients.configure_pipeline(sql_pool_size=workers + 1)
+    service = QueryService(workers=workers, max_queue=int(os.getenv("API_MAX_QUEUE", "64")))
+    web.run_app(
+        make_app(service),
+        host=os.getenv("API_HOST", "0.0.0.0"),
+        port=int(os.getenv("API_PORT", "8080")),
+    )
+
+
+if __name__ == "__main__":
+    main()
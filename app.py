@@ -1,301 +1,284 @@
-from azure.search.documents import SearchClient
-from azure.core.credentials import AzureKeyCredential
-import pyodbc
+import time
+
+# Taken before the other imports, so the sidebar can show what a script run costs
+_run_started = time.perf_counter()
+
+import os
 import streamlit as st
 from dotenv import load_dotenv
-import os
-from openai import OpenAI
-import re
-import json
-import pandas as pd
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+import clients
+import pipeline
+from rule_router import RuleRouter
+from sql_filters import statement_cache_info
+import tracing
 
 
 load_dotenv()
 
-search_endpoint = os.getenv("AZURE_SEARCH_ENDPOINT")
-search_key = os.getenv("AZURE_SEARCH_API_KEY")
-search_index = os.getenv("AZURE_SEARCH_INDEX")
-
-search_client = SearchClient(
-    endpoint=search_endpoint,
-    index_name=search_index,
-    credential=AzureKeyCredential(search_key)
+# --- Per-query tracing: spans for every stage, optionally written to a log ---
+# TRACE_FORMAT is "jsonl" (one line per span) or "otlp" (OpenTelemetry JSON per query)
+tracing.configure(
+    os.getenv("TRACE_LOG_PATH") or None,
+    os.getenv("TRACE_FORMAT", "jsonl").strip().lower(),
 )
 
-server = os.getenv("server").strip()
-database = os.getenv("database").strip()
-sql_username = os.getenv("sql_username").strip()
-password = os.getenv("password").strip()
-driver = os.getenv("driver").strip()
+# Every client below is created on first use and cached once per process, so
+# rendering the page and rerunning the script never wait on connection setup.
+# The builders in clients.py only import the Azure, OpenAI and pyodbc packages
+# at that point too.
 
+# --- Resume retrieval: Azure AI Search, or a local index file (VECTOR_BACKEND) ---
+@st.cache_resource
+def get_vector_backend():
+    return clients.make_vector_backend()
 
-sql_conn = pyodbc.connect(
-    f"Driver={driver};Server={server};Database={database};Uid={sql_username};Pwd={password};Encrypt=yes;TrustServerCertificate=no;Connection Timeout=30;"
-)
-cursor = sql_conn.cursor()
 
-client = OpenAI(api_key = os.getenv("OPENAI_API_KEY"))
+# --- SQL connection pool, shared by all sessions and reruns ---
+@st.cache_resource
+def get_sql_pool():
+    return clients.make_sql_pool()
 
 
-ALLOWED_COLUMNS = {"candidate_id", "name", "location", "email", "status"}
-ALLOWED_OPERATORS = {
-    "=", "like", "and", "or", "where", ">", "<", ">=", "<=", "not", "in"
-}
-def classify_query_llm(query: str) -> str:
-    """
-    Uses LLM to classify the query as 'sql', 'vector', or 'both'.
+# --- Candidate snapshot: joins vector hits and answers simple SQL plans in memory ---
+# The indexer stores candidates.candidate_id on every chunk, so hits join on it
+# directly. New rows are fetched past the id high-water mark; edits reload it.
+@st.cache_resource
+def get_candidate_snapshot():
+    return clients.make_candidate_snapshot(get_sql_pool())
+
+
+# --- Name/email lookup, kept in sync with the candidate rows ---
+@st.cache_resource
+def get_name_index():
+    return clients.make_name_index()
+
+
+# --- Rule-based fast path for common query shapes ---
+@st.cache_resource
+def get_rule_router():
+    return RuleRouter()
+
+
+@st.cache_resource
+def get_openai_client():
+    return clients.make_openai_client()
+
+
+# --- Persistent query embeddings, shared with the indexer (EMBEDDING_CACHE_PATH) ---
+@st.cache_resource
+def get_embedding_cache():
+    return clients.make_embedding_cache()
+
+
+# --- Cache for deterministic LLM routing and SQL plans ---
+# Cached as a resource so it survives Streamlit reruns and is shared by sessions
+@st.cache_resource
+def get_llm_cache():
+    return clients.make_llm_cache()
+
+
+def configure_pipeline():
     """
-    prompt = f"""
-    You are a routing engine for a candidate search app.
-    - SQL: for structured data like candidate name, location, email, status.
-    - Vector: for searching semantic content of resumes.
-    - Both: if the query requires both structured and semantic search.
-
-    Only respond with one word: sql, vector, or both.
-    Query: "{query}"
-    Category:
+    Hands this app's clients to the query pipeline (pipeline.py), creating
+    them on the first query. Cheap after that: every getter is cached.
     """
-    response = client.chat.completions.create(
-        model="gpt-4o-mini",  # fast and cheap
-        messages=[{"role": "system", "content": "You are a helpful query router."},
-                  {"role": "user", "content": prompt}],
-        temperature=0
+    pipeline.configure(
+        client=get_openai_client(),
+        sql_pool=get_sql_pool(),
+        vector_backend=get_vector_backend(),
+        llm_cache=get_llm_cache(),
+        rule_router=get_rule_router(),
+        name_index=get_name_index(),
+        get_candidate_rows=get_candidate_snapshot(),
+        candidate_snapshot=get_candidate_snapshot(),
+        embedding_cache=get_embedding_cache(),
     )
-    return response.choices[0].message.content.strip().lower()
 
 
-# --- Helper: get candidate_ids from SQL search ---
-def get_candidate_ids_by_name(name_query):
-    name_parts = name_query.strip().split()
-    patterns = [f"%{part}%" for part in name_parts]
+STREAM_ANSWERS = os.getenv("STREAM_ANSWERS", "true").strip().lower() != "false"
 
-    # Use OR instead of AND here
-    sql = """
-    SELECT candidate_id, name FROM candidates
-    WHERE """ + " OR ".join(
-        ["(LOWER(name) LIKE LOWER(?) OR LOWER(email) LIKE LOWER(?))"] * len(name_parts)
-    )
 
-    params = []
-    for p in patterns:
-        params.extend([p, p])
+def attach_script_context():
+    """
+    thread_init for the search branches: lets worker threads use st.* and
+    Streamlit caches under the current script run.
+    """
+    ctx = get_script_run_ctx()
+    return lambda: add_script_run_ctx(ctx=ctx)
 
-    cursor.execute(sql, params)
-    rows = cursor.fetchall()
 
-    return [r[0] for r in rows]
+# --- Script run timings: the first run in a process vs. later reruns ---
+@st.cache_resource
+def get_run_timings():
+    return {"cold_start_ms": None, "reruns": 0, "rerun_ms_total": 0.0, "last_rerun_ms": None}
 
 
-#---- Vector search without filtering-----
-def search_vector(query):
-    results = search_client.search(
-        search_text=query,
-        top=3
-    )
-    return [{"candidate_id": r["candidate_id"], "content": r["content"]} for r in results]
-
-# --- Extract candidate name from query using LLM ---
-def extract_candidate_name(query: str) -> str:
-    prompt = f"""
-        Extract only the candidate's full name from the following query.  
-        If there is no name, respond with an empty string.
-
-        Query: "{query}"
-        Candidate Name:
-        """
-    response = client.chat.completions.create(
-        model="gpt-4o-mini",
-        messages=[
-            {"role": "system", "content": "You extract candidate names from queries."},
-            {"role": "user", "content": prompt},
-        ],
-        temperature=0,
-    )
-    name = response.choices[0].message.content.strip()
-    return name
-# --- Vector search filtered by candidate_id ---
-def search_vector_for_candidates(query, candidate_ids):
-    if not candidate_ids:
-        # fallback: no filter
-        return search_vector(query)
-
-    # Detect if candidate_id field is string or int
-    # For demo assume string
-    filter_expr = " or ".join([f"candidate_id eq '{cid}'" for cid in candidate_ids])
-
-    results = search_client.search(
-        search_text=query,
-        filter=filter_expr,
-        top=3
-    )
-    return [{"candidate_id": r["candidate_id"], "content": r["content"]} for r in results]
-
-
-# ===== Safe SQL Search =====
-def is_safe_clause(where_clause: str) -> bool:
-    clause = where_clause.lower()
-
-    # Block dangerous keywords and characters
-    forbidden_keywords = ["drop", "delete", "update", "insert", "alter", "truncate", ";", "--", "union", "exec", "execute"]
-    if any(word in clause for word in forbidden_keywords):
-        return False
-
-    # Remove string literals to avoid false token matches
-    clause_no_strings = re.sub(r"'[^']*'", "", clause)
-
-    # Extract tokens: words, operators, parentheses, commas, numbers, %
-    tokens = re.findall(r"[a-zA-Z_]+|[><=]+|%+|\(|\)|,|\d+", clause_no_strings)
-
-    for token in tokens:
-        token = token.strip()
-        if not token:
-            continue
-        # Allow parentheses and commas as tokens
-        if token in ("(", ")", ","):
-            continue
-        # Allow numbers
-        if token.isdigit():
-            continue
-        # Check if alphabetic token is allowed
-        if token.isalpha():
-            if token not in ALLOWED_COLUMNS and token not in ALLOWED_OPERATORS:
-                return False
-        else:
-            # For operators like >=, <=, =, etc., assume safe if part of allowed operators
-            # They are captured above as separate tokens, so you can skip or allow here
-            continue
-
-    return True
-# ===== SQL Search =====
-def search_sql(query):
-    sql_prompt = f"""
-        You are an expert SQL generator for the 'candidates' table with columns:
-        candidate_id, name, location, email, status.
-
-        For this natural language query, output TWO things exactly in this format:
-
-        SELECT: column1, column2, ...
-        WHERE: <where clause>
-
-        The SELECT line should contain only the columns the user is requesting.
-
-        The WHERE line should be a safe SQL WHERE clause filtering the candidates.
-
-        Only output these two lines exactly, no extra text.
-
-        Query: "{query}"
-    """
+def record_run_time(timings, elapsed_ms):
+    if timings["cold_start_ms"] is None:
+        timings["cold_start_ms"] = elapsed_ms
+    else:
+        timings["reruns"] += 1
+        timings["rerun_ms_total"] += elapsed_ms
+        timings["last_rerun_ms"] = elapsed_ms
 
-    response_text = client.chat.completions.create(
-        model="gpt-4o-mini",
-        messages=[
-            {"role": "system", "content": "You are a SQL query generator."},
-            {"role": "user", "content": sql_prompt}
-        ],
-        temperature=0,
-    ).choices[0].message.content.strip()
-
-    st.write("LLM SQL output:", response_text)  # debug
-
-    # Parse the response
-    select_line = None
-    where_line = None
-    for line in response_text.splitlines():
-        line = line.strip()
-        if line.lower().startswith("select:"):
-            select_line = line[len("select:"):].strip()
-        elif line.lower().startswith("where:"):
-            where_line = line[len("where:"):].strip()
-
-    if not select_line or not where_line:
-        return [{"error": "Failed to parse LLM response"}]
-
-    # Validate columns in SELECT
-    selected_columns = [col.strip() for col in select_line.split(",")]
-    for col in selected_columns:
-        if col not in ALLOWED_COLUMNS:
-            return [{"error": f"Invalid column requested: {col}"}]
-
-    # Validate WHERE clause safely
-    if not is_safe_clause(where_line):
-        return [{"error": "Unsafe SQL detected, query aborted."}]
-
-    sql = f"SELECT {', '.join(selected_columns)} FROM candidates WHERE {where_line}"
-    cursor.execute(sql)
-    rows = cursor.fetchall()
-
-    # Build response dicts dynamically based on selected columns
-    results = []
-    for row in rows:
-        result = {}
-        for idx, col in enumerate(selected_columns):
-            result[col] = row[idx]
-        results.append(result)
-
-    return results
-
-# --- LLM answer synthesis ---
-def synthesize_answer(user_query, sql_results, vector_results):
-    prompt = f"""
-        You are an expert assistant that answers candidate queries precisely.
-
-        Candidate Info (from SQL): {sql_results}
-
-        Relevant Resume Excerpts (from semantic search): {vector_results}
-
-        User Question: {user_query}
-
-        Based on the above, provide a concise and accurate answer focused only on the candidate(s) in question.
-        """
-    response = client.chat.completions.create(
-        model="gpt-4o-mini",
-        messages=[
-            {"role": "system", "content": "You answer candidate questions based on given data."},
-            {"role": "user", "content": prompt}
-        ],
-        temperature=0,
-    )
-    return response.choices[0].message.content.strip()
+
+# --- Result pages after the first, fetched on demand ---
+def load_next_page(state):
+    configure_pipeline()
+    page = pipeline.next_page(state["cursor"])
+    state["pages"].append(list(page))
+    state["cursor"] = page.cursor
+
+
+@st.fragment
+def show_more_results(name, cursor):
+    """
+    Renders the pages loaded so far after a branch's first page. "Load more"
+    fetches one page and reruns only this fragment, not the search.
+    """
+    state = st.session_state.setdefault(f"more_{name}", {"cursor": cursor, "pages": []})
+    for page in state["pages"]:
+        st.write(page)
+    if state["cursor"]:
+        st.button("Load more", key=f"load_more_{name}", on_click=load_next_page, args=(state,))
 
 
 # --- Modified search flow in Streamlit ---
 st.title("LLM-Based Candidate Search")
 
 user_query = st.text_input("Enter your query:")
-
-if st.button("Search") and user_query:
-    route = classify_query_llm(user_query)
-    st.write(f"**LLM decided route:** `{route}`")
-
-    sql_results = []
-    vector_results = []
-    final_answer = None
-
-    if route in ["sql", "both"]:
-        sql_results = search_sql(user_query)
-        st.subheader("SQL Search Results")
-        st.write(sql_results)
-
-    if route in ["vector", "both"]:
-        
-        candidate_name = extract_candidate_name(user_query)
-        if candidate_name:
-            candidate_ids = get_candidate_ids_by_name(candidate_name)
-            if candidate_ids:
-                vector_results = search_vector_for_candidates(user_query, candidate_ids)
-            else:
-                vector_results = search_vector(user_query)
-        else:
-            vector_results = search_vector(user_query)
-
-        st.subheader("Vector Search Results")
-        st.write(vector_results)
+search_clicked = st.button("Search")
+
+# Everything up to here is what each rerun costs before the page is usable
+run_timings = get_run_timings()
+record_run_time(run_timings, (time.perf_counter() - _run_started) * 1000)
+
+if search_clicked and user_query:
+    configure_pipeline()
+    with tracing.span("query", query=user_query) as trace:
+        route, plan, route_source = pipeline.plan_route(user_query)
+        route_labels = {
+            "rules": "Rule-based route (no LLM call)",
+            "planner": "LLM planned route",
+            "classifier": "LLM decided route",
+        }
+        st.write(f"**{route_labels[route_source]}:** `{route}`")
+        trace.set(route=route)
+
+        # Lay out one slot per branch up front and fill each as soon as its data arrives
+        branch_labels = {"sql": "SQL", "vector": "Vector"}
+        placeholders = {}
+        for name in ["sql", "vector"]:
+            if route in [name, "both"]:
+                st.subheader(f"{branch_labels[name]} Search Results")
+                placeholders[name] = st.empty()
+                placeholders[name].caption("Searching...")
+
+        results = {}
+        for name in branch_labels:
+            st.session_state.pop(f"more_{name}", None)
+        for name, result, elapsed in pipeline.iter_search_branches(
+            user_query, route, plan, attach_script_context()
+        ):
+            results[name] = result
+            with placeholders[name].container():
+                st.caption(f"{branch_labels[name]} branch took {elapsed:.2f}s")
+                st.write(list(result))
+                show_more_results(name, getattr(result, "cursor", None))
+
+        sql_results = results.get("sql", [])
+        vector_results = results.get("vector", [])
+        final_answer = None
 
         # If both results available, synthesize final answer
         if route == "both":
-            final_answer = synthesize_answer(user_query, sql_results, vector_results)
             st.subheader("Final Synthesized Answer")
-            st.write(final_answer)
+            context = pipeline.build_context(user_query, sql_results, vector_results)
+            if STREAM_ANSWERS:
+                answer_placeholder = st.empty()
+                start = time.perf_counter()
+                first_token_at = None
+                final_answer = ""
+                with tracing.span("llm.synthesize", stream=True) as span:
+                    for piece in pipeline.synthesize_answer_stream(user_query, sql_results, vector_results, context):
+                        if first_token_at is None:
+                            first_token_at = time.perf_counter() - start
+                            span.set(first_token_ms=round(first_token_at * 1000))
+                        final_answer += piece
+                        answer_placeholder.markdown(final_answer + "▌")
+                answer_placeholder.markdown(final_answer)
+                total = time.perf_counter() - start
+                st.caption(f"First token after {first_token_at or total:.2f}s, full answer in {total:.2f}s")
+            else:
+                start = time.perf_counter()
+                final_answer = pipeline.synthesize_answer(user_query, sql_results, vector_results, context)
+                st.write(final_answer)
+                st.caption(f"Answer took {time.perf_counter() - start:.2f}s")
+            st.caption(
+                f"Prompt context: {context['tokens']} tokens "
+                f"({context['tokens_saved']} saved vs. {context['raw_tokens']} for the unformatted results)"
+            )
+
+    # Per-stage timings for this query, replacing the old debug output
+    with st.expander(f"Timing: {trace.duration * 1000:.0f} ms"):
+        st.code(tracing.format_waterfall(trace), language=None)
+
+
+# The sidebar is filled last: stats only exist for clients a query has created
+with st.sidebar:
+    if run_timings["reruns"]:
+        st.caption(
+            f"Script runs: cold start {run_timings['cold_start_ms']:.0f} ms, reruns "
+            f"{run_timings['rerun_ms_total'] / run_timings['reruns']:.0f} ms avg "
+            f"(last {run_timings['last_rerun_ms']:.0f} ms)"
+        )
+    else:
+        st.caption(f"Script runs: cold start {run_timings['cold_start_ms']:.0f} ms")
+
+    if pipeline.llm_cache is not None:
+        cache_stats = pipeline.llm_cache.stats()
+        st.caption(
+            f"LLM cache: {cache_stats['hits']} hits "
+            f"({cache_stats['semantic_hits']} near-duplicate), "
+            f"{cache_stats['misses']} misses, {cache_stats['size']} entries"
+        )
+    if pipeline.embedding_cache is not None:
+        embedding_stats = pipeline.embedding_cache.stats()
+        st.caption(
+            f"Embedding cache: {embedding_stats['hits']} hits, {embedding_stats['misses']} misses, "
+            f"{embedding_stats['entries']}/{embedding_stats['max_entries']} entries"
+        )
+    if pipeline.rule_router is not None:
+        router_stats = pipeline.rule_router.stats()
+        st.caption(
+            f"Rule fast path: {router_stats['fast_path_rate']:.0%} of queries "
+            f"({router_stats['fast_path']} fast, {router_stats['fallbacks']} via LLM)"
+        )
+    statement_cache = statement_cache_info()
+    st.caption(
+        f"SQL statement shapes: {statement_cache.currsize} cached, "
+        f"{statement_cache.hits} reused"
+    )
+    if pipeline.sql_pool is not None:
+        pool_stats = pipeline.sql_pool.stats()
+        st.caption(
+            f"SQL pool: {pool_stats['in_use']}/{pool_stats['size']} in use, "
+            f"avg wait {pool_stats['avg_wait_ms']:.1f} ms, {pool_stats['timeouts']} timeouts, "
+            f"{pool_stats['reconnects']} reconnects"
+        )
+    if pipeline.candidate_snapshot is not None:
+        snapshot_stats = pipeline.candidate_snapshot.stats()
+        st.caption(
+            f"Candidate snapshot: {snapshot_stats['rows']} rows, "
+            f"{snapshot_stats['served']} SQL plans served in memory, "
+            f"{snapshot_stats['fallbacks']} sent to SQL"
+        )
+    if pipeline.name_index is not None:
+        name_stats = pipeline.name_index.stats()
+        st.caption(
+            f"Name index: {name_stats['candidates']} candidates, {name_stats['tokens']} tokens"
+        )
 
 
 
@@ -0,0 +1,121 @@
+import argparse
+import json
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from dotenv import load_dotenv
+
+import clients
+from llm_cache import normalize_query
+import pipeline
+import tracing
+
+
+def read_queries(path):
+    """
+    Yields (id, query) from a JSONL file: one object per line with a "query"
+    key (or, in the requests.jsonl shape, "body"/"title") and an optional
+    "id" or "request_id". Lines without an id are numbered.
+    """
+    with open(path, encoding="utf-8") as f:
+        for number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            query = record.get("query") or record.get("body") or record.get("title")
+            if query:
+                yield record.get("id") or record.get("request_id") or number, query
+
+
+def answer(query_id, query):
+    try:
+        return {"id": query_id, **pipeline.result_record(pipeline.run_query(query))}
+    except Exception as e:
+        return {"id": query_id, "query": query, "error": f"{type(e).__name__}: {e}"}
+
+
+def run_batch(queries, output, concurrency=8, embed_batch_size=256):
+    """
+    Answers (id, query) pairs with at most `concurrency` queries in flight and
+    writes one JSON line per query to `output` as soon as it finishes, so
+    results come out in completion order. Query embeddings are requested up
+    front in batches, and identical LLM sub-calls (routes, plans, SQL plans,
+    name extraction) are shared across the batch through the response cache.
+    Returns a summary dict.
+    """
+    queries = list(queries)
+    start = time.perf_counter()
+
+    if pipeline.RETRIEVAL_MODE != "keyword":
+        embedded = pipeline.embed_texts(
+            [normalize_query(query) for _, query in queries], batch_size=embed_batch_size
+        )
+        print(f"Embedded {embedded} distinct queries in batches of {embed_batch_size}", file=sys.stderr)
+
+    errors = 0
+    done = 0
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        pending = set()
+        remaining = iter(queries)
+        while True:
+            # Keep the executor's queue short instead of submitting the whole file
+            for query_id, query in remaining:
+                pending.add(executor.submit(answer, query_id, query))
+                if len(pending) >= concurrency * 2:
+                    break
+            if not pending:
+                break
+            finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in finished:
+                result = future.result()
+                errors += "error" in result
+                done += 1
+                output.write(json.dumps(result, default=str) + "\n")
+                output.flush()
+
+    elapsed = time.perf_counter() - start
+    return {
+        "queries": done,
+        "errors": errors,
+        "seconds": elapsed,
+        "queries_per_sec": done / elapsed if elapsed else 0.0,
+        "llm_cache": pipeline.llm_cache.stats(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Answers a JSONL file of queries without the Streamlit app and "
+                    "writes one JSON result per line."
+    )
+    parser.add_argument("input", help="JSONL file, one {\"query\": ...} object per line")
+    parser.add_argument("-o", "--output", help="JSONL output path (default: stdout)")
+    parser.add_argument("--concurrency", type=int, default=8, help="queries in flight at once")
+    parser.add_argument("--embed-batch-size", type=int, default=256)
+    args = parser.parse_args()
+
+    load_dotenv()
+    tracing.configure(None)
+    # One connection per query in flight, plus one for candidate rows refreshes
+    clients.configure_pipeline(sql_pool_size=args.concurrency + 1)
+    pipeline.EMBEDDING_MEMO_SIZE = max(pipeline.EMBEDDING_MEMO_SIZE, 100000)
+
+    output = open(args.output, "w", encoding="utf-8") if args.output else sys.stdout
+    try:
+        summary = run_batch(read_queries(args.input), output, args.concurrency, args.embed_batch_size)
+    finally:
+        if output is not sys.stdout:
+            output.close()
+
+    cache = summary["llm_cache"]
+    print(
+        f"{summary['queries']} queries ({summary['errors']} failed) in {summary['seconds']:.1f}s, "
+        f"{summary['queries_per_sec']:.2f} queries/s; LLM cache {cache['hits']} hits, "
+        f"{cache['coalesced']} coalesced, {cache['misses']} misses",
+        file=sys.stderr,
+    )
+
+
+if __name__ == "__main__":
+    main()
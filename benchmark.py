@@ -0,0 +1,330 @@
+import argparse
+import hashlib
+import json
+import math
+import os
+import random
+import re
+import sqlite3
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+from llm_cache import ResponseCache
+from name_index import NameIndex
+import pipeline
+from rule_router import RuleRouter
+from SQL_Insert_candidates_data_ import load_candidates
+from sql_pool import ConnectionPool
+import tracing
+from vector_backends import LocalVectorBackend, write_local_index
+
+
+FIRST_NAMES = [
+    "Alice", "Bob", "Charlie", "Diana", "Ethan", "Fiona", "George", "Hannah", "Ian", "Jessica",
+    "Kevin", "Laura", "Mohammed", "Nina", "Omar", "Priya", "Quinn", "Rosa", "Samuel", "Tara",
+    "Umar", "Valerie", "Wei", "Ximena", "Yusuf", "Zoe",
+]
+LAST_NAMES = [
+    "Smith", "Lee", "Prince", "Hunt", "Gallagher", "Martin", "Brown", "Curtis", "Jones", "Nguyen",
+    "Patel", "Garcia", "Chen", "Singh", "Tremblay", "Roy", "Wilson", "Taylor", "Khan", "Murphy",
+]
+CITIES = [
+    "Vancouver", "Montreal", "Calgary", "Ottawa", "Halifax", "Edmonton", "Winnipeg",
+    "Quebec City", "Victoria", "Toronto", "Regina", "Saskatoon",
+]
+STATUSES = ["Applied", "Interviewed", "Hired", "Rejected"]
+SKILLS = [
+    "python", "java", "sql", "azure", "aws", "react", "kubernetes", "docker", "spark",
+    "machine learning", "data engineering", "project management", "tableau", "golang",
+]
+
+
+# --- Fake OpenAI client ---
+class FakeLLM:
+    """
+    Stands in for the OpenAI client with a configurable latency: a fixed delay
+    per call plus a delay per completion token. Answers are derived from the
+    synthetic corpus through a RuleRouter, so routes and plans are plausible
+    and deterministic. Embeddings are hashed bags of words.
+    """
+
+    def __init__(self, candidate_rows, latency_ms=300.0, ms_per_token=10.0,
+                 embed_latency_ms=50.0, jitter=0.2, dimensions=64, seed=0):
+        self.latency_ms = latency_ms
+        self.ms_per_token = ms_per_token
+        self.embed_latency_ms = embed_latency_ms
+        self.jitter = jitter
+        self.dimensions = dimensions
+        self._random = random.Random(seed)
+        self._router = RuleRouter()
+        self._router.update_vocabulary(candidate_rows)
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._chat))
+        self.embeddings = SimpleNamespace(create=self._embed)
+
+    def _sleep(self, ms):
+        time.sleep(max(ms * (1 + self._random.uniform(-self.jitter, self.jitter)), 0) / 1000)
+
+    def embed(self, text):
+        vector = [0.0] * self.dimensions
+        for word in re.findall(r"[a-z0-9]+", text.lower()):
+            digest = hashlib.md5(word.encode()).digest()
+            vector[digest[0] % self.dimensions] += 1.0 if digest[1] % 2 else -1.0
+        norm = math.sqrt(sum(v * v for v in vector)) or 1.0
+        return [v / norm for v in vector]
+
+    def _embed(self, model, input):
+        texts = input if isinstance(input, list) else [input]
+        self._sleep(self.embed_latency_ms)
+        return SimpleNamespace(
+            data=[SimpleNamespace(embedding=self.embed(text)) for text in texts],
+            usage=SimpleNamespace(prompt_tokens=sum(len(t) // 4 + 1 for t in texts)),
+        )
+
+    def _plan(self, query):
+        plan = self._router._match(query)
+        if plan is None:
+            return {"route": "vector", "candidate_names": [], "select": [], "filter": {"and": []}}
+        return {key: plan[key] for key in ("route", "candidate_names", "select", "filter")}
+
+    def _answer(self, system, prompt):
+        match = re.search(r'(?:Query|User Question): "?(.*?)"?\n', prompt)
+        query = match.group(1) if match else ""
+        if "query router" in system:
+            return self._plan(query)["route"]
+        if "query planner" in system:
+            return json.dumps(self._plan(query))
+        if "SQL query generator" in system:
+            plan = self._plan(query)
+            return json.dumps({"select": plan["select"] or ["candidate_id", "name"],
+                               "filter": plan["filter"]})
+        if "extract candidate names" in system:
+            names = self._plan(query)["candidate_names"]
+            return names[0] if names else ""
+        return "Based on the data, the candidate matches the question. " * 6
+
+    def _chat(self, model, messages, temperature=0, response_format=None, stream=False,
+              stream_options=None):
+        system, prompt = messages[0]["content"], messages[-1]["content"]
+        text = self._answer(system, prompt + "\n")
+        usage = SimpleNamespace(
+            prompt_tokens=sum(len(m["content"]) // 4 + 1 for m in messages),
+            completion_tokens=len(text) // 4 + 1,
+        )
+        if stream:
+            return self._stream(text, usage)
+        self._sleep(self.latency_ms + self.ms_per_token * usage.completion_tokens)
+        message = SimpleNamespace(content=text)
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)], usage=usage)
+
+    def _stream(self, text, usage):
+        self._sleep(self.latency_ms)
+        for piece in re.findall(r"\S+\s*", text):
+            self._sleep(self.ms_per_token)
+            delta = SimpleNamespace(content=piece)
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=delta)], usage=None)
+        yield SimpleNamespace(choices=[], usage=usage)
+
+
+# --- Synthetic corpus ---
+def synthetic_candidates(count, seed=0):
+    rng = random.Random(seed)
+    for i in range(count):
+        first, last = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+        yield (
+            f"{first} {last}",
+            rng.choice(STATUSES),
+            f"{first}.{last}{i}@example.com".lower(),
+            rng.choice(CITIES),
+        )
+
+
+def synthetic_resume_chunks(candidate_rows, count, embed, seed=0):
+    rng = random.Random(seed)
+    chunks = []
+    for candidate_id, row in list(candidate_rows.items())[:count]:
+        skills = rng.sample(SKILLS, 4)
+        sections = {
+            "Summary": f"{row['name']} is a {rng.randint(2, 15)} year engineer based in {row['location']}.",
+            "Skills": "Skills: " + ", ".join(skills) + ".",
+            "Work Experience": f"Built {skills[0]} services and led {skills[1]} projects at a "
+                               f"{rng.choice(['bank', 'startup', 'retailer', 'hospital'])}.",
+        }
+        for n, (section, content) in enumerate(sections.items()):
+            chunks.append({
+                "chunk_id": f"{candidate_id}-{n}",
+                "candidate_id": candidate_id,
+                "section": section,
+                "content": content,
+                "embedding": embed(content),
+            })
+    return chunks
+
+
+def build_environment(args, workdir):
+    """
+    Builds a SQLite candidates table, a local resume index and a fake LLM,
+    and configures the pipeline with them.
+    """
+    db_path = os.path.join(workdir, "candidates.db")
+    conn = sqlite3.connect(db_path)
+    stats = load_candidates(conn, synthetic_candidates(args.candidates, args.seed),
+                            batch_size=10000, progress=False)
+    columns = ["candidate_id", "name", "location", "email", "status"]
+    candidate_rows = {
+        str(row[0]): dict(zip(columns, row))
+        for row in conn.execute("SELECT candidate_id, name, location, email, status FROM candidates")
+    }
+    conn.close()
+    print(f"Loaded {stats['rows']} candidates ({stats['rows_per_sec']:.0f} rows/s)")
+
+    llm = FakeLLM(
+        candidate_rows, latency_ms=args.llm_latency_ms, ms_per_token=args.ms_per_token,
+        embed_latency_ms=args.embed_latency_ms, seed=args.seed,
+    )
+    chunks = synthetic_resume_chunks(candidate_rows, args.resumes, llm.embed, args.seed)
+    index_path = os.path.join(workdir, "resume_index")
+    write_local_index(index_path, chunks)
+    vector_backend = LocalVectorBackend(index_path)
+    print(f"Indexed {len(chunks)} resume chunks with {type(vector_backend).__name__}")
+
+    llm_cache = ResponseCache(
+        max_entries=1024 if args.llm_cache else 0,
+        ttl_seconds=3600,
+        embed_fn=pipeline.embed_text,
+    )
+    pipeline.configure(
+        client=llm,
+        sql_pool=ConnectionPool(
+            lambda: sqlite3.connect(db_path, check_same_thread=False),
+            max_size=args.concurrency * 2 + 1,
+        ),
+        vector_backend=vector_backend,
+        llm_cache=llm_cache,
+        rule_router=RuleRouter(),
+        name_index=NameIndex(),
+        get_candidate_rows=lambda: candidate_rows,
+    )
+    pipeline.SQL_DIALECT = "sqlite"
+    pipeline.USE_RULE_ROUTER = args.planning == "auto"
+    pipeline.USE_QUERY_PLANNER = args.planning in ("auto", "planner")
+    return candidate_rows
+
+
+# --- Query mixes ---
+def load_queries(path):
+    """Reads queries from a JSONL file: one object per line with a "query" key."""
+    with open(path, encoding="utf-8") as f:
+        records = [json.loads(line) for line in f if line.strip()]
+    return [r.get("query") or r.get("body") or r.get("title") for r in records]
+
+
+def generate_queries(candidate_rows, count, seed=0):
+    rng = random.Random(seed)
+    rows = list(candidate_rows.values())
+    templates = [
+        lambda r: f"candidates in {r['location']}",
+        lambda r: f"status of {r['name']}",
+        lambda r: f"emails of {r['status'].lower()} candidates in {r['location']}",
+        lambda r: f"{r['name']} skills",
+        lambda r: f"status and experience of {r['name']}",
+        lambda r: f"who knows {rng.choice(SKILLS)}",
+        lambda r: f"which candidates worked with {rng.choice(SKILLS)} in {r['location']}",
+    ]
+    return [rng.choice(templates)(rng.choice(rows)) for _ in range(count)]
+
+
+# --- Reporting ---
+def percentile(values, pct):
+    ordered = sorted(values)
+    rank = max(math.ceil(pct / 100 * len(ordered)) - 1, 0)
+    return ordered[rank]
+
+
+def summarize(traces):
+    """Per-span-name count, mean and p50/p95/p99 in milliseconds."""
+    durations = {}
+    for trace in traces:
+        for _, span in trace.walk():
+            durations.setdefault(span.name, []).append((span.duration or 0.0) * 1000)
+    return {
+        name: {
+            "count": len(values),
+            "mean_ms": sum(values) / len(values),
+            "p50_ms": percentile(values, 50),
+            "p95_ms": percentile(values, 95),
+            "p99_ms": percentile(values, 99),
+        }
+        for name, values in sorted(durations.items())
+    }
+
+
+def print_report(report):
+    print(
+        f"\n{report['queries']} queries in {report['seconds']:.2f}s "
+        f"({report['throughput_qps']:.1f} queries/s, concurrency {report['concurrency']})"
+    )
+    width = max(len(name) for name in report["stages"])
+    print(f"{'stage'.ljust(width)} {'count':>7} {'mean':>9} {'p50':>9} {'p95':>9} {'p99':>9}")
+    for name, s in report["stages"].items():
+        print(
+            f"{name.ljust(width)} {s['count']:7d} {s['mean_ms']:9.1f} {s['p50_ms']:9.1f} "
+            f"{s['p95_ms']:9.1f} {s['p99_ms']:9.1f}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Replays a query mix through the pipeline against offline stand-ins "
+                    "(fake LLM, SQLite, local resume index) and reports per-stage latency."
+    )
+    parser.add_argument("--candidates", type=int, default=10000, help="rows in the candidates table")
+    parser.add_argument("--resumes", type=int, default=2000, help="candidates with an indexed resume")
+    parser.add_argument("--queries", help="JSONL file of queries; a generated mix by default")
+    parser.add_argument("--count", type=int, default=200, help="generated queries")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--planning", choices=["auto", "planner", "steps"], default="auto",
+                        help="auto: rules, then planner; planner: LLM planner only; "
+                             "steps: classifier, name extraction and SQL generation calls")
+    parser.add_argument("--llm-latency-ms", type=float, default=300.0)
+    parser.add_argument("--ms-per-token", type=float, default=10.0)
+    parser.add_argument("--embed-latency-ms", type=float, default=50.0)
+    parser.add_argument("--no-llm-cache", dest="llm_cache", action="store_false")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="also write the report as JSON to this path")
+    args = parser.parse_args()
+
+    tracing.configure(None)
+    with tempfile.TemporaryDirectory() as workdir:
+        candidate_rows = build_environment(args, workdir)
+        queries = load_queries(args.queries) if args.queries else generate_queries(
+            candidate_rows, args.count, args.seed
+        )
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+            outcomes = list(executor.map(pipeline.run_query, queries))
+        elapsed = time.perf_counter() - start
+
+    routes = {}
+    for outcome in outcomes:
+        key = f"{outcome['route_source']}:{outcome['route']}"
+        routes[key] = routes.get(key, 0) + 1
+    report = {
+        "queries": len(outcomes),
+        "seconds": elapsed,
+        "throughput_qps": len(outcomes) / elapsed if elapsed else 0.0,
+        "concurrency": args.concurrency,
+        "routes": routes,
+        "stages": summarize([outcome["trace"] for outcome in outcomes]),
+    }
+    print_report(report)
+    print("Routes:", ", ".join(f"{k}={v}" for k, v in sorted(routes.items())))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,255 @@
+import re
+import threading
+import time
+from bisect import bisect_left, bisect_right
+
+from sql_filters import And, Condition
+import tracing
+
+
+CANDIDATE_COLUMNS = ["candidate_id", "name", "location", "email", "status"]
+CANDIDATE_ROW_CHECKSUM = "BINARY_CHECKSUM(candidate_id, name, location, email, status)"
+# One round trip: row count, highest id, a checksum of the rows at or below
+# the snapshot's high-water mark and a checksum of every row
+CANDIDATES_VERSION_SQL = (
+    f"SELECT COUNT(*), MAX(candidate_id), "
+    f"CHECKSUM_AGG(CASE WHEN candidate_id <= ? THEN {CANDIDATE_ROW_CHECKSUM} END), "
+    f"CHECKSUM_AGG({CANDIDATE_ROW_CHECKSUM}) "
+    f"FROM candidates"
+)
+CANDIDATE_ROWS_SQL = (
+    f"SELECT {', '.join(CANDIDATE_COLUMNS)} FROM candidates "
+    f"WHERE candidate_id > ? AND candidate_id <= ? ORDER BY candidate_id"
+)
+
+
+def fetch_candidates_version(sql_pool, high_water):
+    """(count, max id, checksum of rows with id <= high_water, checksum of all rows)."""
+    def fetch(cursor):
+        cursor.execute(CANDIDATES_VERSION_SQL, [high_water])
+        return tuple(cursor.fetchone())
+
+    with tracing.span("sql.candidates_version"):
+        return sql_pool.run(fetch)
+
+
+def fetch_candidate_rows(sql_pool, after_id, up_to_id):
+    """Rows with after_id < candidate_id <= up_to_id as {str(candidate_id): row dict}."""
+    def fetch(cursor):
+        cursor.execute(CANDIDATE_ROWS_SQL, [after_id, up_to_id])
+        return cursor.fetchall()
+
+    with tracing.span("sql.candidate_rows", after_id=after_id) as span:
+        rows = sql_pool.run(fetch)
+        span.set(rows=len(rows))
+    return {str(row[0]): dict(zip(CANDIDATE_COLUMNS, row)) for row in rows}
+
+
+# --- In-memory filter evaluation ---
+def _string_key(value):
+    # Matches the default case- and trailing-space-insensitive SQL Server collation
+    return value.rstrip().casefold()
+
+
+def _like_pattern(value):
+    """LIKE pattern as a regex, or None for patterns with [...] character classes."""
+    if not isinstance(value, str) or "[" in value:
+        return None
+    pattern = "".join(
+        ".*" if ch == "%" else "." if ch == "_" else re.escape(ch) for ch in value.rstrip()
+    )
+    return re.compile(pattern + r"\s*", re.IGNORECASE | re.DOTALL)
+
+
+class CandidateTable:
+    """
+    An immutable, column-oriented copy of the candidates table. select()
+    evaluates a sql_filters AST over it, or returns None for predicates whose
+    result could differ from SQL Server's (string range comparisons, LIKE
+    character classes, values that need a type conversion).
+    """
+
+    def __init__(self, rows):
+        self.rows = rows  # {str(candidate_id): row dict}, in candidate_id order
+        self.columns = {
+            column: [row[column] for row in rows.values()] for column in CANDIDATE_COLUMNS
+        }
+        self._indexes = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.rows)
+
+    def _key(self, column, value):
+        if column == "candidate_id":
+            if isinstance(value, str):
+                value = value.strip()
+                return int(value) if value.lstrip("-").isdigit() else None
+            if isinstance(value, float) and not value.is_integer():
+                return None
+            return int(value)
+        return _string_key(value) if isinstance(value, str) else None
+
+    def _value_index(self, column):
+        """{key: [positions]} for equality and IN lookups, built on first use."""
+        index = self._indexes.get(column)
+        if index is None:
+            index = {}
+            for position, value in enumerate(self.columns[column]):
+                if value is not None:
+                    key = value if column == "candidate_id" else _string_key(value)
+                    index.setdefault(key, []).append(position)
+            with self._lock:
+                index = self._indexes.setdefault(column, index)
+        return index
+
+    def _match(self, node):
+        """Positions of the rows matching node, or None if it must go to SQL."""
+        if isinstance(node, Condition):
+            return self._match_condition(node)
+        parts = []
+        for item in node.items:
+            part = self._match(item)
+            if part is None:
+                return None
+            parts.append(part)
+        if isinstance(node, And):
+            return set.intersection(*parts) if parts else set(range(len(self.rows)))
+        return set().union(*parts)
+
+    def _match_condition(self, node):
+        column, op, value = node
+        values = self.columns[column]
+
+        if op in ("=", "in", "!="):
+            keys = [self._key(column, v) for v in (value if op == "in" else (value,))]
+            if None in keys:
+                return None
+            index = self._value_index(column)
+            matches = set().union(*(index.get(key, ()) for key in keys))
+            if op != "!=":
+                return matches
+            return {pos for pos, v in enumerate(values) if v is not None} - matches
+
+        if op == "like":
+            pattern = _like_pattern(value) if column != "candidate_id" else None
+            if pattern is None:
+                return None
+            return {pos for pos, v in enumerate(values) if v is not None and pattern.fullmatch(v)}
+
+        # Range comparisons: only on ids, where collation order doesn't matter
+        key = self._key(column, value) if column == "candidate_id" else None
+        if key is None:
+            return None
+        compare = {"<": int.__lt__, "<=": int.__le__, ">": int.__gt__, ">=": int.__ge__}[op]
+        return {pos for pos, v in enumerate(values) if v is not None and compare(v, key)}
+
+    def select(self, selected_columns, node, after_id=None, limit=None):
+        """
+        Matching rows as tuples of selected_columns in candidate_id order, or
+        None. after_id and limit page through them like the keyset statement.
+        """
+        positions = self._match(node)
+        if positions is None:
+            return None
+        positions = sorted(positions)
+        if after_id is not None:
+            # Rows are stored in candidate_id order, so ids past after_id start at one position
+            start = bisect_right(self.columns["candidate_id"], after_id)
+            positions = positions[bisect_left(positions, start):]
+        if limit is not None:
+            positions = positions[:limit]
+        columns = [self.columns[column] for column in selected_columns]
+        return [tuple(column[pos] for column in columns) for pos in positions]
+
+
+# --- Snapshot ---
+class CandidateSnapshot:
+    """
+    The candidates table kept in memory and refreshed from SQL. The version
+    is checked at most every check_seconds:
+      - new rows above the candidate_id high-water mark are fetched on their own;
+      - a changed checksum below the mark (updates, deletes) reloads the table;
+      - so does ttl_seconds passing since the last full load.
+    Calling the snapshot returns {candidate_id: row dict}, the same object
+    until the table changes, which the rule router and name index use to skip
+    rebuilding. select() answers simple SELECT ... WHERE plans from memory.
+    """
+
+    def __init__(self, sql_pool, check_seconds=30, ttl_seconds=300):
+        self.sql_pool = sql_pool
+        self.check_seconds = check_seconds
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._table = None
+        self._high_water = 0
+        self._checksum = None
+        self._checked_at = 0.0
+        self._loaded_at = 0.0
+
+        self.full_loads = 0
+        self.incremental_loads = 0
+        self.served = 0
+        self.fallbacks = 0
+
+    def __call__(self):
+        return self.table().rows
+
+    def table(self):
+        with self._lock:
+            now = time.monotonic()
+            if self._table is not None and now - self._checked_at < self.check_seconds:
+                return self._table
+            self._checked_at = now
+            if self._table is None or now - self._loaded_at > self.ttl_seconds:
+                self._load(now)
+                return self._table
+
+            count, max_id, checksum_below, checksum_all = fetch_candidates_version(
+                self.sql_pool, self._high_water
+            )
+            if checksum_below != self._checksum:
+                # Rows under the mark were updated or deleted
+                self._load(now)
+            elif (max_id or 0) > self._high_water:
+                rows = dict(self._table.rows)
+                rows.update(fetch_candidate_rows(self.sql_pool, self._high_water, max_id))
+                self._table = CandidateTable(rows)
+                self._high_water, self._checksum = max_id, checksum_all
+                self.incremental_loads += 1
+            if len(self._table) != count:
+                # Changed while we read it; the next check reloads
+                self._checksum = None
+            return self._table
+
+    def _load(self, now):
+        count, max_id, _, checksum_all = fetch_candidates_version(self.sql_pool, 0)
+        self._high_water = max_id or 0
+        self._table = CandidateTable(fetch_candidate_rows(self.sql_pool, 0, self._high_water))
+        self._checksum = checksum_all if len(self._table) == count else None
+        self._loaded_at = now
+        self.full_loads += 1
+
+    def select(self, selected_columns, node, after_id=None, limit=None):
+        """
+        Rows for SELECT selected_columns WHERE node from the snapshot, or None
+        when the filter has to run in SQL.
+        """
+        rows = self.table().select(selected_columns, node, after_id, limit)
+        with self._lock:
+            if rows is None:
+                self.fallbacks += 1
+            else:
+                self.served += 1
+        return rows
+
+    def stats(self):
+        with self._lock:
+            return {
+                "rows": len(self._table) if self._table is not None else 0,
+                "high_water": self._high_water,
+                "full_loads": self.full_loads,
+                "incremental_loads": self.incremental_loads,
+                "served": self.served,
+                "fallbacks": self.fallbacks,
+            }
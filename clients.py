@@ -0,0 +1,118 @@
+import os
+
+from candidate_snapshot import CandidateSnapshot
+from llm_cache import ResponseCache
+from name_index import NameIndex
+import pipeline
+from rule_router import RuleRouter
+from sql_pool import ConnectionPool
+
+
+# Builds the pipeline's clients from the same environment variables as app.py,
+# for entry points without Streamlit (batch runs, the API service). The Azure,
+# OpenAI and pyodbc packages are only imported when a client is built.
+
+def make_vector_backend():
+    from vector_backends import AzureSearchBackend, LocalVectorBackend
+
+    # "azure" searches the Azure AI Search index, "local" an index file written by the indexer
+    if os.getenv("VECTOR_BACKEND", "azure").strip().lower() == "local":
+        return LocalVectorBackend(
+            os.getenv("LOCAL_INDEX_PATH", "resume_index"),
+            ann=os.getenv("LOCAL_INDEX_ANN", "false").strip().lower() == "true",
+        )
+
+    from azure.core.credentials import AzureKeyCredential
+    from azure.search.documents import SearchClient
+
+    search_client = SearchClient(
+        endpoint=os.getenv("AZURE_SEARCH_ENDPOINT"),
+        index_name=os.getenv("AZURE_SEARCH_INDEX"),
+        credential=AzureKeyCredential(os.getenv("AZURE_SEARCH_API_KEY"))
+    )
+    return AzureSearchBackend(search_client)
+
+
+def sql_connection_string():
+    server = os.getenv("server").strip()
+    database = os.getenv("database").strip()
+    sql_username = os.getenv("sql_username").strip()
+    password = os.getenv("password").strip()
+    driver = os.getenv("driver").strip()
+    return f"Driver={driver};Server={server};Database={database};Uid={sql_username};Pwd={password};Encrypt=yes;TrustServerCertificate=no;Connection Timeout=30;"
+
+
+def make_sql_pool(max_size=None):
+    import pyodbc
+
+    connection_string = sql_connection_string()
+    return ConnectionPool(
+        lambda: pyodbc.connect(connection_string),
+        min_size=int(os.getenv("SQL_POOL_MIN_SIZE", "1")),
+        max_size=max_size or int(os.getenv("SQL_POOL_MAX_SIZE", "5")),
+        acquire_timeout=float(os.getenv("SQL_POOL_ACQUIRE_TIMEOUT", "10")),
+    )
+
+
+def make_openai_client():
+    from openai import OpenAI
+
+    return OpenAI(api_key = os.getenv("OPENAI_API_KEY"))
+
+
+def make_llm_cache():
+    return ResponseCache(
+        max_entries=int(os.getenv("LLM_CACHE_MAX_ENTRIES", "1024")),
+        ttl_seconds=float(os.getenv("LLM_CACHE_TTL_SECONDS", "86400")),
+        db_path=os.getenv("LLM_CACHE_DB") or None,
+        embed_fn=pipeline.embed_text,
+        similarity_threshold=float(os.getenv("LLM_CACHE_SIMILARITY", "0.97")),
+    )
+
+
+def make_name_index():
+    return NameIndex(min_similarity=float(os.getenv("NAME_MATCH_MIN_SIMILARITY", "0.3")))
+
+
+def make_embedding_cache():
+    """The persistent embedding cache at EMBEDDING_CACHE_PATH, or None when unset."""
+    path = os.getenv("EMBEDDING_CACHE_PATH")
+    if not path:
+        return None
+    from embedding_cache import EmbeddingCache
+
+    return EmbeddingCache(
+        path,
+        max_entries=int(os.getenv("EMBEDDING_CACHE_MAX_ENTRIES", "100000")),
+        dtype=os.getenv("EMBEDDING_CACHE_DTYPE", "float16").strip().lower(),
+    )
+
+
+def make_candidate_snapshot(sql_pool):
+    return CandidateSnapshot(
+        sql_pool,
+        check_seconds=int(os.getenv("CANDIDATE_CHANGE_CHECK_SECONDS", "30")),
+        ttl_seconds=int(os.getenv("CANDIDATE_ROWS_TTL_SECONDS", "300")),
+    )
+
+
+def configure_pipeline(sql_pool_size=None):
+    """
+    Builds every client from the environment and hands them to the pipeline.
+    Returns the configured dependencies.
+    """
+    sql_pool = make_sql_pool(sql_pool_size)
+    candidate_snapshot = make_candidate_snapshot(sql_pool)
+    dependencies = {
+        "client": make_openai_client(),
+        "sql_pool": sql_pool,
+        "vector_backend": make_vector_backend(),
+        "llm_cache": make_llm_cache(),
+        "rule_router": RuleRouter(),
+        "name_index": make_name_index(),
+        "get_candidate_rows": candidate_snapshot,
+        "candidate_snapshot": candidate_snapshot,
+        "embedding_cache": make_embedding_cache(),
+    }
+    pipeline.configure(**dependencies)
+    return dependencies
@@ -0,0 +1,161 @@
+import re
+from functools import lru_cache
+
+
+STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "by", "candidate", "candidates", "do", "does",
+    "for", "from", "has", "have", "in", "is", "it", "of", "on", "or", "the", "their", "to",
+    "what", "which", "who", "with", "his", "her", "he", "she", "they", "me", "show", "list",
+    "tell", "about", "any", "all", "give", "find", "get",
+}
+
+
+# --- Token counting ---
+# tiktoken and its encoding are loaded on the first count, not at import, since
+# loading the encoding dominates the app's startup time
+@lru_cache(maxsize=1)
+def _encoding():
+    try:
+        import tiktoken
+    except ImportError:  # fall back to a rough characters-per-token estimate
+        return None
+    try:
+        return tiktoken.encoding_for_model("gpt-4o-mini")
+    except KeyError:
+        return tiktoken.get_encoding("o200k_base")
+
+
+def count_tokens(text: str) -> int:
+    encoding = _encoding()
+    if encoding is None:
+        return len(text) // 4 + 1
+    return len(encoding.encode(text))
+
+
+def terms(text: str):
+    return {t for t in re.findall(r"[a-z0-9#+]+", text.lower()) if t not in STOPWORDS}
+
+
+def split_sentences(text: str):
+    return [s.strip() for s in re.split(r"(?<=[.!?])\s+|\n+", text) if s.strip()]
+
+
+# --- SQL rows as a compact table ---
+def format_sql_table(rows, budget):
+    """
+    Renders SQL result dicts as a pipe-separated table, one header line and one
+    line per row, stopping before the token budget is exceeded.
+    """
+    if not rows:
+        return "(no rows)"
+    columns = list(rows[0].keys())
+    lines = [" | ".join(columns)]
+    used = count_tokens(lines[0])
+    for i, row in enumerate(rows):
+        line = " | ".join("" if row.get(col) is None else str(row.get(col)) for col in columns)
+        line_tokens = count_tokens(line)
+        if used + line_tokens > budget:
+            lines.append(f"(+{len(rows) - i} more rows)")
+            break
+        lines.append(line)
+        used += line_tokens
+    return "\n".join(lines)
+
+
+# --- Resume passages: dedupe and keep the most relevant sentences ---
+def _is_duplicate(sentence_terms, kept_terms, threshold=0.8):
+    for other in kept_terms:
+        union = sentence_terms | other
+        if union and len(sentence_terms & other) / len(union) >= threshold:
+            return True
+    return False
+
+
+def select_resume_sentences(query, vector_results, budget):
+    """
+    Splits every result's passages into sentences, drops exact and near
+    duplicates within a candidate (chunk overlap repeats text), and keeps the
+    sentences that share the most terms with the query until the token budget
+    is spent. The best sentence of every candidate is taken first so no
+    candidate is dropped.
+    Returns {candidate_id: [sentences in original order]}.
+    """
+    query_terms = terms(query)
+    candidates = []
+    for rank, result in enumerate(vector_results):
+        scored = []
+        seen = set()
+        kept_terms = []
+        for position, sentence in enumerate(split_sentences(result["content"])):
+            key = " ".join(sentence.lower().split()).strip(" .")
+            sentence_terms = terms(sentence)
+            # Skip bare section headers and passage separators
+            if not sentence_terms or sentence.endswith(":"):
+                continue
+            if key in seen or _is_duplicate(sentence_terms, kept_terms):
+                continue
+            seen.add(key)
+            kept_terms.append(sentence_terms)
+            overlap = len(query_terms & sentence_terms)
+            # Ties go to better-ranked results and to earlier sentences
+            scored.append(((overlap, -rank, -position), position, sentence))
+        scored.sort(reverse=True)
+        candidates.append((result["candidate_id"], scored))
+
+    picked = {candidate_id: [] for candidate_id, _ in candidates}
+    used = 0
+    ordered = [(cid, scored[0]) for cid, scored in candidates if scored]
+    ordered += sorted(
+        ((cid, item) for cid, scored in candidates for item in scored[1:]),
+        key=lambda pair: pair[1][0],
+        reverse=True,
+    )
+    for candidate_id, (_, position, sentence) in ordered:
+        sentence_tokens = count_tokens(sentence)
+        if used + sentence_tokens > budget:
+            continue
+        picked[candidate_id].append((position, sentence))
+        used += sentence_tokens
+
+    return {cid: [s for _, s in sorted(sentences)] for cid, sentences in picked.items() if sentences}
+
+
+# --- Full synthesis context ---
+def build_synthesis_context(query, sql_results, vector_results, sql_budget=600, resume_budget=1200):
+    """
+    Builds the SQL and resume parts of the synthesis prompt within their token
+    budgets. Also reports how many tokens the previous prompt's raw reprs of
+    the same results would have taken, and how many were saved.
+    """
+    sql_text = format_sql_table(sql_results, sql_budget)
+
+    names = {
+        r["candidate_id"]: (r.get("candidate") or {}).get("name") for r in vector_results
+    }
+    blocks = []
+    for candidate_id, sentences in select_resume_sentences(query, vector_results, resume_budget).items():
+        label = f"Candidate {candidate_id}"
+        if names.get(candidate_id):
+            label += f" ({names[candidate_id]})"
+        blocks.append(label + ":\n" + "\n".join(f"- {s}" for s in sentences))
+    resume_text = "\n\n".join(blocks) if blocks else "(no resume excerpts)"
+
+    # Baseline: what the prompt held before this builder, the SQL rows and an
+    # id/name/content excerpt per hit (not the passages and joined rows kept for the UI)
+    raw_excerpts = [
+        {
+            "candidate_id": r["candidate_id"],
+            "name": (r.get("candidate") or {}).get("name"),
+            "content": r["content"],
+        }
+        for r in vector_results
+    ]
+    raw_tokens = count_tokens(str(sql_results)) + count_tokens(str(raw_excerpts))
+    tokens = count_tokens(sql_text) + count_tokens(resume_text)
+    return {
+        "sql": sql_text,
+        "resumes": resume_text,
+        "tokens": tokens,
+        "raw_tokens": raw_tokens,
+        "tokens_saved": max(raw_tokens - tokens, 0),
+    }
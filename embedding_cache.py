@@ -0,0 +1,295 @@
+import argparse
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from collections import Counter
+
+import numpy as np
+
+from llm_cache import normalize_query
+
+
+EMBEDDING_DTYPES = {"float16", "float32"}
+# SQLite's default limit on bound parameters per statement
+_MAX_PARAMS = 900
+
+
+def cache_key(model, text):
+    return hashlib.sha256(f"{model}\n{text}".encode("utf-8")).hexdigest()
+
+
+def _chunks(items, size=_MAX_PARAMS):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+class EmbeddingCache:
+    """
+    Persistent embedding store keyed by model and text, shared by the indexer
+    and the query pipeline so no text is embedded twice.
+
+    Vectors are kept in a fixed-size, memory-mapped matrix of max_entries
+    rows (`<path>.vectors`, float16 by default), and the key -> row index in
+    SQLite (`<path>.sqlite`). When every row is used, the least recently used
+    entry is overwritten. Rows are claimed in SQLite transactions and only
+    read once marked ready, so several processes can use the same files.
+    The row count, dtype and dimension are fixed when the files are created.
+    """
+
+    def __init__(self, path, max_entries=100000, dtype="float16"):
+        if dtype not in EMBEDDING_DTYPES:
+            raise ValueError(f"Unknown embedding dtype: {dtype}")
+        self.path = path
+        self.max_entries = max_entries
+        self.dtype = dtype
+        self.dim = None
+        self._vectors = None
+        self._lock = threading.Lock()
+        self._touched = {}  # key -> last use not yet written to SQLite
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._db = sqlite3.connect(
+            path + ".sqlite", timeout=30, isolation_level=None, check_same_thread=False
+        )
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            """
+            CREATE TABLE IF NOT EXISTS embeddings (
+                key TEXT PRIMARY KEY,
+                slot INTEGER NOT NULL UNIQUE,
+                ready INTEGER NOT NULL,
+                last_used REAL NOT NULL
+            )
+            """
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS ix_embeddings_last_used ON embeddings (last_used)")
+        self._db.execute("CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        self._open_vectors()
+
+    def _open_vectors(self):
+        meta = dict(self._db.execute("SELECT name, value FROM meta").fetchall())
+        if "dim" not in meta:
+            return False
+        self.dim = int(meta["dim"])
+        self.dtype = meta["dtype"]
+        self.max_entries = int(meta["max_entries"])
+        self._vectors = np.memmap(
+            self.path + ".vectors", dtype=self.dtype, mode="r+", shape=(self.max_entries, self.dim)
+        )
+        return True
+
+    def _create_vectors(self, dim):
+        # Inside the write transaction, so only one process creates the file
+        if self._open_vectors():
+            return
+        with open(self.path + ".vectors", "wb") as f:
+            f.truncate(self.max_entries * dim * np.dtype(self.dtype).itemsize)
+        self._db.executemany(
+            "INSERT INTO meta (name, value) VALUES (?, ?)",
+            [("dim", str(dim)), ("dtype", self.dtype), ("max_entries", str(self.max_entries))],
+        )
+        self._open_vectors()
+
+    # --- Reads ---
+    def _ready_slots(self, keys):
+        slots = {}
+        for chunk in _chunks(keys):
+            slots.update(self._db.execute(
+                f"SELECT key, slot FROM embeddings WHERE ready = 1 "
+                f"AND key IN ({', '.join('?' * len(chunk))})",
+                chunk,
+            ).fetchall())
+        return slots
+
+    def get_many(self, model, texts):
+        """{text: embedding} for the texts that are cached."""
+        keys = {cache_key(model, text): text for text in dict.fromkeys(texts)}
+        with self._lock:
+            if self._vectors is None and not self._open_vectors():
+                self.misses += len(keys)
+                return {}
+            slots = self._ready_slots(list(keys))
+            vectors = {key: self._vectors[slot].astype(np.float32) for key, slot in slots.items()}
+            # Another process may have evicted a row while it was read
+            confirmed = self._ready_slots(list(vectors))
+            found = {
+                keys[key]: vector.tolist()
+                for key, vector in vectors.items() if confirmed.get(key) == slots[key]
+            }
+            now = time.time()
+            for key in confirmed:
+                self._touched[key] = now
+            self.hits += len(found)
+            self.misses += len(keys) - len(found)
+        return found
+
+    def get(self, model, text):
+        return self.get_many(model, [text]).get(text)
+
+    # --- Writes ---
+    def put_many(self, model, items):
+        """
+        Stores (text, embedding) pairs. Returns how many were stored: none
+        if their dimension differs from the cache's.
+        """
+        items = dict(items)
+        if not items:
+            return 0
+        dim = len(next(iter(items.values())))
+        with self._lock:
+            if self.dim is not None and dim != self.dim:
+                return 0
+            now = time.time()
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                if self._vectors is None:
+                    self._create_vectors(dim)
+                if dim != self.dim:
+                    self._db.execute("ROLLBACK")
+                    return 0
+                self._write_touched()
+                slots = {
+                    cache_key(model, text): self._claim_slot(cache_key(model, text), now)
+                    for text in items
+                }
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+
+            # Claimed rows are unreferenced until marked ready, so nobody reads them mid-write
+            for text, embedding in items.items():
+                self._vectors[slots[cache_key(model, text)]] = np.asarray(embedding, dtype=np.float32)
+            self._vectors.flush()
+            for chunk in _chunks(list(slots)):
+                self._db.execute(
+                    f"UPDATE embeddings SET ready = 1 WHERE key IN ({', '.join('?' * len(chunk))})",
+                    chunk,
+                )
+        return len(items)
+
+    def put(self, model, text, embedding):
+        return self.put_many(model, [(text, embedding)])
+
+    def _claim_slot(self, key, now):
+        row = self._db.execute("SELECT slot FROM embeddings WHERE key = ?", (key,)).fetchone()
+        if row is not None:
+            slot = row[0]
+            self._db.execute("UPDATE embeddings SET ready = 0, last_used = ? WHERE key = ?", (now, key))
+            return slot
+        slot = self._db.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        if slot >= self.max_entries:
+            # Full: take over the least recently used row
+            old_key, slot = self._db.execute(
+                "SELECT key, slot FROM embeddings ORDER BY last_used LIMIT 1"
+            ).fetchone()
+            self._db.execute("DELETE FROM embeddings WHERE key = ?", (old_key,))
+            self._touched.pop(old_key, None)
+            self.evictions += 1
+        self._db.execute(
+            "INSERT INTO embeddings (key, slot, ready, last_used) VALUES (?, ?, 0, ?)",
+            (key, slot, now),
+        )
+        return slot
+
+    def _write_touched(self):
+        if self._touched:
+            self._db.executemany(
+                "UPDATE embeddings SET last_used = MAX(last_used, ?) WHERE key = ?",
+                [(used, key) for key, used in self._touched.items()],
+            )
+            self._touched.clear()
+
+    def flush(self):
+        """Writes recent uses to SQLite so other processes evict by them too."""
+        with self._lock:
+            self._write_touched()
+
+    def close(self):
+        self.flush()
+        with self._lock:
+            self._db.close()
+
+    def stats(self):
+        with self._lock:
+            entries = self._db.execute("SELECT COUNT(*) FROM embeddings WHERE ready = 1").fetchone()[0]
+            lookups = self.hits + self.misses
+            return {
+                "entries": entries,
+                "max_entries": self.max_entries,
+                "dtype": self.dtype,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+
+# --- Warm-up from query logs ---
+def _logged_query(record):
+    """The user query in one log line: a trace span, an OTLP trace or a query file line."""
+    if record.get("name") == "query" and record.get("parent_id") is None:
+        return (record.get("attributes") or {}).get("query")
+    if "resourceSpans" in record:
+        for resource in record["resourceSpans"]:
+            for scope in resource.get("scopeSpans", []):
+                for s in scope.get("spans", []):
+                    if s.get("name") == "query" and not s.get("parentSpanId"):
+                        for attribute in s.get("attributes", []):
+                            if attribute["key"] == "query":
+                                return attribute["value"].get("stringValue")
+        return None
+    return record.get("query")
+
+
+def frequent_queries(paths, top=1000):
+    """
+    The `top` most frequent queries, normalized the way the pipeline embeds
+    them, from JSONL trace logs (TRACE_LOG_PATH, either format) or query files.
+    """
+    counts = Counter()
+    for path in paths:
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                query = _logged_query(json.loads(line))
+                if isinstance(query, str) and query.strip():
+                    counts[normalize_query(query)] += 1
+    return [query for query, _ in counts.most_common(top)]
+
+
+def main():
+    from dotenv import load_dotenv
+
+    import clients
+    import pipeline
+
+    parser = argparse.ArgumentParser(
+        description="Embeds the most frequent logged queries into the embedding cache "
+                    "(EMBEDDING_CACHE_PATH), so they are answered without an embeddings call."
+    )
+    parser.add_argument("logs", nargs="+", help="trace logs or query files (JSONL)")
+    parser.add_argument("--top", type=int, default=1000, help="how many distinct queries to embed")
+    parser.add_argument("--batch-size", type=int, default=256)
+    args = parser.parse_args()
+
+    load_dotenv()
+    embedding_cache = clients.make_embedding_cache()
+    if embedding_cache is None:
+        parser.error("EMBEDDING_CACHE_PATH is not set")
+    pipeline.configure(client=clients.make_openai_client(), embedding_cache=embedding_cache)
+
+    queries = frequent_queries(args.logs, args.top)
+    embedded = pipeline.embed_texts(queries, batch_size=args.batch_size)
+    print(f"{len(queries)} frequent queries: {embedded} embedded, {len(queries) - embedded} already cached")
+    embedding_cache.close()
+
+
+if __name__ == "__main__":
+    main()
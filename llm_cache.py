@@ -0,0 +1,310 @@
+import json
+import math
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+
+# --- Key normalization ---
+def normalize_query(text: str) -> str:
+    """
+    Lowercases the query, collapses whitespace and drops trailing punctuation,
+    so "List candidates from Calgary?" and "list  candidates from calgary" share a key.
+    """
+    text = re.sub(r"\s+", " ", text.strip().lower())
+    return text.strip(" ?.!")
+
+
+def cosine_similarity(a, b) -> float:
+    dot = sum(x * y for x, y in zip(a, b))
+    norm_a = math.sqrt(sum(x * x for x in a))
+    norm_b = math.sqrt(sum(y * y for y in b))
+    if not norm_a or not norm_b:
+        return 0.0
+    return dot / (norm_a * norm_b)
+
+
+def unit_vector(embedding):
+    vector = np.asarray(embedding, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+class SemanticIndex:
+    """
+    L2-normalized embeddings of one namespace's cached queries, one matrix
+    row each, so a lookup is a single matrix-vector product. Freed rows are
+    zeroed and reused; the matrix doubles when full.
+    """
+
+    def __init__(self, dim):
+        self.matrix = np.zeros((16, dim), dtype=np.float32)
+        self.keys = []   # row -> entry key, None for free rows
+        self.rows = {}   # entry key -> row
+        self._free = []
+
+    def add(self, entry_key, embedding):
+        if len(embedding) != self.matrix.shape[1]:
+            self.remove(entry_key)
+            return
+        row = self.rows.get(entry_key)
+        if row is None:
+            if self._free:
+                row = self._free.pop()
+            else:
+                row = len(self.keys)
+                self.keys.append(None)
+                if row == len(self.matrix):
+                    # A new array, so scans holding the old one are unaffected
+                    grown = np.zeros((2 * len(self.matrix), self.matrix.shape[1]), dtype=np.float32)
+                    grown[:row] = self.matrix
+                    self.matrix = grown
+            self.rows[entry_key] = row
+            self.keys[row] = entry_key
+        self.matrix[row] = unit_vector(embedding)
+
+    def remove(self, entry_key):
+        row = self.rows.pop(entry_key, None)
+        if row is not None:
+            self.keys[row] = None
+            self.matrix[row] = 0.0
+            self._free.append(row)
+
+
+# --- Response cache ---
+class ResponseCache:
+    """
+    Bounded LRU cache with a TTL for deterministic (temperature=0) LLM responses.
+
+    Entries are keyed by namespace and normalized query text. Lookups made with
+    semantic=True fall back to the most similar cached query in the namespace
+    when its embedding similarity reaches similarity_threshold.
+    Values must be JSON-serializable when db_path is set, since entries are
+    then written through to a local SQLite file and reloaded on start.
+    """
+
+    def __init__(self, max_entries=1024, ttl_seconds=3600, db_path=None,
+                 embed_fn=None, similarity_threshold=0.97):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.embed_fn = embed_fn
+        self.similarity_threshold = similarity_threshold
+
+        # (namespace, key) -> (value, embedding, created_at), oldest use first
+        self._entries = OrderedDict()
+        # namespace -> SemanticIndex of the entries that have an embedding
+        self._semantic = {}
+        self._lock = threading.Lock()
+        # (namespace, key) -> Event for computations in progress
+        self._inflight = {}
+
+        self.hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.coalesced = 0
+
+        self._db = None
+        if db_path:
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.execute(
+                """
+                CREATE TABLE IF NOT EXISTS llm_cache (
+                    namespace TEXT NOT NULL,
+                    key TEXT NOT NULL,
+                    value TEXT NOT NULL,
+                    embedding TEXT,
+                    created_at REAL NOT NULL,
+                    PRIMARY KEY (namespace, key)
+                )
+                """
+            )
+            self._db.commit()
+            self._load()
+
+    def _load(self):
+        cutoff = time.time() - self.ttl_seconds
+        self._db.execute("DELETE FROM llm_cache WHERE created_at < ?", (cutoff,))
+        self._db.commit()
+        rows = self._db.execute(
+            "SELECT namespace, key, value, embedding, created_at FROM llm_cache "
+            "ORDER BY created_at DESC LIMIT ?",
+            (self.max_entries,),
+        ).fetchall()
+        for namespace, key, value, embedding, created_at in reversed(rows):
+            embedding = json.loads(embedding) if embedding else None
+            self._entries[(namespace, key)] = (json.loads(value), embedding, created_at)
+            self._index_embedding((namespace, key), embedding)
+
+    def _expired(self, created_at) -> bool:
+        return time.time() - created_at > self.ttl_seconds
+
+    def _index_embedding(self, entry_key, embedding):
+        index = self._semantic.get(entry_key[0])
+        if embedding is None:
+            if index is not None:
+                index.remove(entry_key)
+            return
+        if index is None:
+            index = self._semantic[entry_key[0]] = SemanticIndex(len(embedding))
+        index.add(entry_key, embedding)
+
+    def _remove(self, entry_key):
+        del self._entries[entry_key]
+        index = self._semantic.get(entry_key[0])
+        if index is not None:
+            index.remove(entry_key)
+        if self._db is not None:
+            self._db.execute(
+                "DELETE FROM llm_cache WHERE namespace = ? AND key = ?", entry_key
+            )
+            self._db.commit()
+
+    def _lookup_exact(self, entry_key):
+        entry = self._entries.get(entry_key)
+        if entry is None:
+            return None
+        if self._expired(entry[2]):
+            self._remove(entry_key)
+            return None
+        self._entries.move_to_end(entry_key)
+        return entry
+
+    def _similar_keys(self, matrix, keys, query_vector):
+        """Entry keys scoring at least the threshold, best first. Runs without the lock."""
+        if len(query_vector) != matrix.shape[1]:
+            return []
+        scores = matrix[:len(keys)] @ query_vector
+        rows = np.flatnonzero(scores >= self.similarity_threshold)
+        return [keys[row] for row in rows[np.argsort(-scores[rows])] if keys[row] is not None]
+
+    def _confirm_similar(self, candidate_keys, query_vector):
+        """
+        The first candidate still cached, unexpired and similar enough, since
+        the cache may have changed during the scan.
+        """
+        for entry_key in candidate_keys:
+            entry = self._entries.get(entry_key)
+            if entry is None or entry[1] is None:
+                continue
+            if self._expired(entry[2]):
+                self._remove(entry_key)
+                continue
+            if float(unit_vector(entry[1]) @ query_vector) >= self.similarity_threshold:
+                self._entries.move_to_end(entry_key)
+                return entry
+        return None
+
+    def get(self, namespace, query, embedding=None):
+        """
+        Returns the cached value for the query, or None on a miss.
+        When an embedding is given, near-duplicate queries also count as hits.
+        """
+        return self._get(namespace, query, None if embedding is None else lambda: embedding)
+
+    def _get(self, namespace, query, embed=None):
+        """get(), calling embed() for the query's embedding only if the exact lookup misses."""
+        entry_key = (namespace, normalize_query(query))
+        index = None
+        with self._lock:
+            entry = self._lookup_exact(entry_key)
+        if entry is None and embed is not None:
+            embedding = embed()
+            with self._lock:
+                index = self._semantic.get(namespace) if embedding is not None else None
+                if index is not None:
+                    matrix, keys = index.matrix, list(index.keys)
+
+        semantic = False
+        if index is not None:
+            # The scan runs without the lock, so it doesn't hold up other lookups
+            query_vector = unit_vector(embedding)
+            candidate_keys = self._similar_keys(matrix, keys, query_vector)
+            if candidate_keys:
+                with self._lock:
+                    entry = self._confirm_similar(candidate_keys, query_vector)
+                semantic = entry is not None
+
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.semantic_hits += semantic
+            return entry[0]
+
+    def put(self, namespace, query, value, embedding=None):
+        entry_key = (namespace, normalize_query(query))
+        created_at = time.time()
+        with self._lock:
+            self._entries[entry_key] = (value, embedding, created_at)
+            self._entries.move_to_end(entry_key)
+            self._index_embedding(entry_key, embedding)
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO llm_cache (namespace, key, value, embedding, created_at) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (*entry_key, json.dumps(value),
+                     json.dumps(embedding) if embedding is not None else None, created_at),
+                )
+                self._db.commit()
+            while len(self._entries) > self.max_entries:
+                oldest_key = next(iter(self._entries))
+                self._remove(oldest_key)
+                self.evictions += 1
+
+    def get_or_compute(self, namespace, query, compute, semantic=False):
+        """
+        Returns the cached value for the query, calling compute() on a miss.
+        None results are not cached, so failed LLM parses are retried next time.
+        Concurrent misses for the same query are coalesced: one caller computes
+        and the others wait for its result.
+        """
+        embedding = None
+
+        def embed():
+            # Only on an exact miss; kept for put() and for lookups after waiting
+            nonlocal embedding
+            if embedding is None:
+                embedding = self.embed_fn(normalize_query(query))
+            return embedding
+
+        entry_key = (namespace, normalize_query(query))
+        while True:
+            value = self._get(namespace, query, embed if semantic and self.embed_fn is not None else None)
+            if value is not None:
+                return value
+            with self._lock:
+                pending = self._inflight.get(entry_key)
+                if pending is None:
+                    self._inflight[entry_key] = threading.Event()
+                    break
+                self.coalesced += 1
+            # Look again once it is done: its result is cached now, unless it was None
+            pending.wait()
+
+        try:
+            value = compute()
+            if value is not None:
+                self.put(namespace, query, value, embedding)
+            return value
+        finally:
+            with self._lock:
+                self._inflight.pop(entry_key).set()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "hits": self.hits,
+                "semantic_hits": self.semantic_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "coalesced": self.coalesced,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
@@ -0,0 +1,188 @@
+import bisect
+import re
+import threading
+from collections import Counter
+
+
+# Scores for how a query token matched an indexed token
+EXACT_SCORE = 1.0
+PREFIX_SCORE = 0.9
+SUBSTRING_SCORE = 0.8
+FUZZY_WEIGHT = 0.7
+
+
+def name_tokens(text: str):
+    """
+    Lowercased tokens of a name or query. Email addresses are kept whole and
+    also split into the words of their local part.
+    """
+    tokens = []
+    for word in (text or "").lower().split():
+        if "@" in word:
+            tokens.append(word.strip(".,;:<>()"))
+            word = word.split("@", 1)[0]
+        tokens.extend(re.findall(r"[a-z0-9]+", word))
+    return tokens
+
+
+def trigrams(token: str):
+    padded = f"  {token} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class NameIndex:
+    """
+    In-process lookup of candidates by name or email, replacing LIKE '%x%'
+    scans. Tokens of `name` and `email` go into an inverted index, with a
+    sorted token list for prefixes and a trigram index for substrings and
+    typos ("jonse" -> "jones").
+
+    sync() takes the {candidate_id: row} dict from the candidates table and
+    only reindexes rows whose name or email changed, so it can be called on
+    every query; passing the same dict object again is a no-op.
+    """
+
+    def __init__(self, min_similarity=0.3):
+        self.min_similarity = min_similarity
+        self._lock = threading.Lock()
+        self._rows = None
+        self._keys = {}          # candidate_id -> (name, email) as indexed
+        self._postings = {}      # token -> set of candidate_ids
+        self._trigrams = {}      # trigram -> set of tokens
+        self._sorted_tokens = []
+
+    # --- Maintenance ---
+    def sync(self, candidate_rows):
+        """
+        Brings the index in line with candidate_rows. Returns the number of
+        candidates added, changed or removed.
+        """
+        if candidate_rows is self._rows:
+            return 0
+        with self._lock:
+            changed = 0
+            for candidate_id in set(self._keys) - set(candidate_rows):
+                self._remove(candidate_id)
+                changed += 1
+            for candidate_id, row in candidate_rows.items():
+                key = (row.get("name") or "", row.get("email") or "")
+                if self._keys.get(candidate_id) == key:
+                    continue
+                if candidate_id in self._keys:
+                    self._remove(candidate_id)
+                self._add(candidate_id, key)
+                changed += 1
+            if changed:
+                self._sorted_tokens = sorted(self._postings)
+            self._rows = candidate_rows
+            return changed
+
+    def _add(self, candidate_id, key):
+        self._keys[candidate_id] = key
+        for token in set(name_tokens(" ".join(key))):
+            postings = self._postings.setdefault(token, set())
+            if not postings:
+                for gram in trigrams(token):
+                    self._trigrams.setdefault(gram, set()).add(token)
+            postings.add(candidate_id)
+
+    def _remove(self, candidate_id):
+        key = self._keys.pop(candidate_id)
+        for token in set(name_tokens(" ".join(key))):
+            postings = self._postings.get(token)
+            if postings is None:
+                continue
+            postings.discard(candidate_id)
+            if not postings:
+                del self._postings[token]
+                for gram in trigrams(token):
+                    self._trigrams[gram].discard(token)
+                    if not self._trigrams[gram]:
+                        del self._trigrams[gram]
+
+    # --- Lookup ---
+    def _token_matches(self, query_token):
+        """
+        {indexed token: score} for one query token: exact, prefix, substring
+        (via trigrams) and fuzzy trigram-similarity matches.
+        """
+        matches = {}
+        if query_token in self._postings:
+            matches[query_token] = EXACT_SCORE
+
+        start = bisect.bisect_left(self._sorted_tokens, query_token)
+        for token in self._sorted_tokens[start:]:
+            if not token.startswith(query_token):
+                break
+            matches.setdefault(token, PREFIX_SCORE)
+
+        if len(query_token) >= 3:
+            query_grams = trigrams(query_token)
+            shared = Counter(
+                token for gram in query_grams for token in self._trigrams.get(gram, ())
+            )
+            for token, count in shared.items():
+                if token in matches:
+                    continue
+                if query_token in token:
+                    matches[token] = SUBSTRING_SCORE
+                    continue
+                similarity = count / (len(query_grams) + len(trigrams(token)) - count)
+                if similarity >= self.min_similarity:
+                    matches[token] = FUZZY_WEIGHT * similarity
+        return matches
+
+    def search(self, query: str):
+        """
+        Ranks candidates for a name or email query. Returns
+        [(candidate_id, matched query tokens, score)], best first: candidates
+        matching more of the query tokens come first, then by score.
+        """
+        query_tokens = list(dict.fromkeys(name_tokens(query)))
+        if not query_tokens:
+            return []
+
+        with self._lock:
+            best = {}
+            for query_token in query_tokens:
+                per_candidate = {}
+                for token, score in self._token_matches(query_token).items():
+                    for candidate_id in self._postings[token]:
+                        if score > per_candidate.get(candidate_id, 0.0):
+                            per_candidate[candidate_id] = score
+                for candidate_id, score in per_candidate.items():
+                    matched, total = best.get(candidate_id, (0, 0.0))
+                    best[candidate_id] = (matched + 1, total + score)
+
+        ranked = [(cid, matched, total) for cid, (matched, total) in best.items()]
+        ranked.sort(key=lambda item: (item[1], item[2]), reverse=True)
+        return ranked
+
+    def lookup(self, query: str):
+        """
+        Candidate ids for a name or email query. Only the candidates matching
+        the most query tokens are returned, so "Bob Smith" does not pull in
+        every other Smith, and fuzzy matches are dropped when a much closer
+        match exists ("smith" does not return "Smyth"). When some candidate
+        matches every query token exactly, only such candidates are returned
+        ("Bob Smith" does not return "Bob Smyth" either).
+        """
+        ranked = self.search(query)
+        if not ranked:
+            return []
+        _, top_matched, top_score = ranked[0]
+        exact_score = len(set(name_tokens(query))) * EXACT_SCORE
+        if top_score >= exact_score:
+            return [candidate_id for candidate_id, _, score in ranked if score >= exact_score]
+        return [
+            candidate_id for candidate_id, matched, score in ranked
+            if matched == top_matched and score >= top_score * 0.5
+        ]
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "candidates": len(self._keys),
+                "tokens": len(self._postings),
+                "trigrams": len(self._trigrams),
+            }
@@ -0,0 +1,785 @@
+import json
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from context_builder import build_synthesis_context
+from llm_cache import normalize_query
+from sql_filters import (
+    PAGE_CLAUSES, FilterError, compile_page, compile_select, parse_columns, parse_filter,
+)
+import tracing
+from vector_backends import RETRIEVAL_MODES, group_by_candidate
+
+
+# The query pipeline, free of Streamlit and of any particular client. app.py
+# (or a benchmark, batch job or service) builds the clients and hands them to
+# configure() before calling into the pipeline.
+client = None            # OpenAI-compatible client: chat.completions / embeddings
+sql_pool = None          # anything with run(work), e.g. sql_pool.ConnectionPool
+vector_backend = None    # a vector_backends.VectorBackend
+llm_cache = None         # llm_cache.ResponseCache
+rule_router = None       # rule_router.RuleRouter
+name_index = None        # name_index.NameIndex
+get_candidate_rows = None  # () -> {candidate_id: row dict}, refreshed by the caller
+candidate_snapshot = None  # candidate_snapshot.CandidateSnapshot, or None to always query SQL
+embedding_cache = None    # embedding_cache.EmbeddingCache, or None to keep embeddings in memory only
+
+DEPENDENCIES = (
+    "client", "sql_pool", "vector_backend", "llm_cache", "rule_router", "name_index",
+    "get_candidate_rows", "candidate_snapshot", "embedding_cache",
+)
+
+
+def configure(**dependencies):
+    """
+    Sets the clients and shared objects the pipeline uses, e.g.
+    configure(client=OpenAI(), sql_pool=pool, vector_backend=backend, ...).
+    Only the given names are replaced, so it is cheap to call before every
+    query with the same objects.
+    """
+    unknown = set(dependencies) - set(DEPENDENCIES)
+    if unknown:
+        raise TypeError(f"Unknown pipeline dependencies: {', '.join(sorted(unknown))}")
+    if "client" in dependencies and dependencies["client"] is not client:
+        # Memoized embeddings belong to the previous client
+        with _embedding_lock:
+            _embeddings.clear()
+    globals().update(dependencies)
+
+
+# --- Resume retrieval: keyword, vector or hybrid (vector + keyword, RRF fused) ---
+RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "hybrid").strip().lower()
+if RETRIEVAL_MODE not in RETRIEVAL_MODES:
+    RETRIEVAL_MODE = "hybrid"
+VECTOR_TOP_K = int(os.getenv("VECTOR_TOP_K", "3"))
+# Resumes are indexed as chunks: fetch more chunks than candidates, then group
+# them per candidate by the max (or sum) of their chunk scores
+CHUNKS_PER_CANDIDATE = int(os.getenv("CHUNKS_PER_CANDIDATE", "5"))
+CHUNK_AGGREGATION = os.getenv("CHUNK_AGGREGATION", "max").strip().lower()
+
+
+# --- Rule-based fast path for common query shapes ---
+USE_RULE_ROUTER = os.getenv("USE_RULE_ROUTER", "true").strip().lower() != "false"
+
+
+def plan_query_fast(query):
+    """
+    Plans the query with the rule router when it is confident, without any
+    LLM call. Returns None when the query needs the LLM planner.
+    """
+    if not USE_RULE_ROUTER:
+        return None
+    with tracing.span("plan.rules") as span:
+        rule_router.update_vocabulary(get_candidate_rows())
+        plan = rule_router.plan(query)
+        span.set(fast_path=plan is not None)
+        return plan
+
+
+def join_candidate_rows(vector_results):
+    """
+    Attaches the candidates table row to each vector result, or None for
+    resumes without a SQL row.
+    """
+    candidate_rows = get_candidate_rows()
+    return Page(
+        ({**result, "candidate": candidate_rows.get(str(result["candidate_id"]))}
+         for result in vector_results),
+        getattr(vector_results, "cursor", None),
+    )
+
+
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "text-embedding-ada-002")
+
+
+EMBEDDING_MEMO_SIZE = int(os.getenv("EMBEDDING_MEMO_SIZE", "256"))
+
+# Memoized so the route cache and vector search share one embedding per query
+_embeddings = OrderedDict()
+_embedding_lock = threading.Lock()
+
+
+def _remember_embedding(text, embedding):
+    with _embedding_lock:
+        _embeddings[text] = embedding
+        _embeddings.move_to_end(text)
+        while len(_embeddings) > EMBEDDING_MEMO_SIZE:
+            _embeddings.popitem(last=False)
+
+
+def _cached_embeddings(texts):
+    """Embeddings of texts found in the persistent cache, memoized as well."""
+    if embedding_cache is None or not texts:
+        return {}
+    found = embedding_cache.get_many(EMBEDDING_MODEL, texts)
+    if found:
+        tracing.add("embedding_cache_hits", len(found))
+    for text, embedding in found.items():
+        _remember_embedding(text, embedding)
+    return found
+
+
+def embed_text(text: str):
+    with _embedding_lock:
+        if text in _embeddings:
+            _embeddings.move_to_end(text)
+            return _embeddings[text]
+    embedding = _cached_embeddings([text]).get(text)
+    if embedding is not None:
+        return embedding
+    # Only reached on a memo and cache miss, so the span shows which stage paid for the call
+    tracing.add("embedding_calls")
+    response = client.embeddings.create(model=EMBEDDING_MODEL, input=text)
+    tracing.record_usage(response.usage)
+    embedding = response.data[0].embedding
+    _remember_embedding(text, embedding)
+    if embedding_cache is not None:
+        embedding_cache.put(EMBEDDING_MODEL, text, embedding)
+    return embedding
+
+
+def embed_texts(texts, batch_size=256):
+    """
+    Embeds many texts with one request per batch_size texts and memoizes the
+    results, so later embed_text calls for them are free. Texts already
+    memoized, cached or repeated are only sent once. Returns how many texts
+    were sent to the API.
+    """
+    with _embedding_lock:
+        missing = [t for t in dict.fromkeys(texts) if t not in _embeddings]
+    cached = _cached_embeddings(missing)
+    missing = [t for t in missing if t not in cached]
+    for start in range(0, len(missing), batch_size):
+        batch = missing[start:start + batch_size]
+        tracing.add("embedding_calls")
+        response = client.embeddings.create(model=EMBEDDING_MODEL, input=batch)
+        tracing.record_usage(response.usage)
+        for text, item in zip(batch, response.data):
+            _remember_embedding(text, item.embedding)
+        if embedding_cache is not None:
+            embedding_cache.put_many(
+                EMBEDDING_MODEL, [(text, item.embedding) for text, item in zip(batch, response.data)]
+            )
+    return len(missing)
+
+
+# --- Cache for deterministic LLM routing and SQL plans ---
+# Near-duplicate matching is only used for routes: SQL plans carry literals
+# ("Calgary" vs "Ottawa") that embeddings can't reliably tell apart.
+LLM_CACHE_SEMANTIC_ROUTES = os.getenv("LLM_CACHE_SEMANTIC", "true").strip().lower() != "false"
+
+
+def cached_llm_call(namespace, query, compute, semantic=False):
+    """
+    llm_cache.get_or_compute under an `llm.<namespace>` span that records
+    whether the cache answered and, on a miss, the tokens the call used.
+    """
+    def run():
+        tracing.set_attributes(cache_hit=False)
+        return compute()
+
+    with tracing.span(f"llm.{namespace}", cache_hit=True):
+        return llm_cache.get_or_compute(namespace, query, run, semantic=semantic)
+
+
+# How the LLM should describe the rows it wants, parsed by sql_filters.parse_filter
+FILTER_FORMAT = """
+    A filter is a JSON object in one of these forms:
+      {"column": "<column>", "op": "<op>", "value": <string or number>}
+        where op is one of =, !=, <, <=, >, >=, like (use % wildcards with like)
+      {"column": "<column>", "op": "in", "value": [<values>]}
+      {"and": [<filter>, ...]} or {"or": [<filter>, ...]}
+    Use {"and": []} to match all candidates.
+"""
+
+
+def classify_query_llm(query: str) -> str:
+    """
+    Uses LLM to classify the query as 'sql', 'vector', or 'both'.
+    """
+    return cached_llm_call(
+        "route", query, lambda: _classify_query_llm(query),
+        semantic=LLM_CACHE_SEMANTIC_ROUTES,
+    )
+
+
+def _classify_query_llm(query: str) -> str:
+    prompt = f"""
+    You are a routing engine for a candidate search app.
+    - SQL: for structured data like candidate name, location, email, status.
+    - Vector: for searching semantic content of resumes.
+    - Both: if the query requires both structured and semantic search.
+
+    Only respond with one word: sql, vector, or both.
+    Query: "{query}"
+    Category:
+    """
+    response = client.chat.completions.create(
+        model="gpt-4o-mini",  # fast and cheap
+        messages=[{"role": "system", "content": "You are a helpful query router."},
+                  {"role": "user", "content": prompt}],
+        temperature=0
+    )
+    tracing.record_usage(response.usage)
+    return response.choices[0].message.content.strip().lower()
+
+
+# --- Query planner: route, names and SQL in a single LLM call ---
+ROUTES = {"sql", "vector", "both"}
+USE_QUERY_PLANNER = os.getenv("USE_QUERY_PLANNER", "true").strip().lower() != "false"
+
+
+def plan_query(query: str):
+    """
+    Uses one LLM call to plan the whole query: route, candidate names and the
+    SELECT columns and row filter for the candidates table.
+    Returns a validated plan dict, or None so callers can fall back to
+    classify_query_llm / extract_candidate_name / search_sql.
+    """
+    # v2: plans carry a structured filter instead of a WHERE string
+    return cached_llm_call("query_plan.v2", query, lambda: _plan_query(query))
+
+
+def _plan_query(query: str):
+    prompt = f"""
+    You plan queries for a candidate search app.
+    The 'candidates' SQL table has columns: candidate_id, name, location, email, status.
+    Resumes are searched semantically for skills, experience and other resume content.
+
+    Respond with a JSON object with exactly these keys:
+    - "route": "sql" for structured data (name, location, email, status),
+      "vector" for resume content, or "both" if the query needs both.
+    - "candidate_names": list of candidate full names mentioned in the query, or [].
+    - "select": list of the table columns the user is requesting, or [] if route is "vector".
+    - "filter": a filter selecting the candidates the query is about,
+      or {{"and": []}} if route is "vector".
+    {FILTER_FORMAT}
+    Query: "{query}"
+    """
+    response = client.chat.completions.create(
+        model="gpt-4o-mini",
+        messages=[
+            {"role": "system", "content": "You are a query planner that returns JSON only."},
+            {"role": "user", "content": prompt},
+        ],
+        temperature=0,
+        response_format={"type": "json_object"},
+    )
+    tracing.record_usage(response.usage)
+    try:
+        plan = json.loads(response.choices[0].message.content)
+    except (TypeError, json.JSONDecodeError):
+        return None
+    return validate_query_plan(plan)
+
+
+def validate_query_plan(plan):
+    """
+    Checks a raw planner response and normalizes it, or returns None if any
+    part of it is missing or unsafe.
+    """
+    if not isinstance(plan, dict):
+        return None
+
+    route = str(plan.get("route", "")).strip().lower()
+    if route not in ROUTES:
+        return None
+
+    names = plan.get("candidate_names") or []
+    if isinstance(names, str):
+        names = [names]
+    if not isinstance(names, list) or not all(isinstance(n, str) for n in names):
+        return None
+    names = [n.strip() for n in names if n.strip()]
+
+    selected_columns = []
+    filter_data = {"and": []}
+    if route in ["sql", "both"]:
+        selected_columns = plan.get("select") or []
+        if isinstance(selected_columns, str):
+            selected_columns = selected_columns.split(",")
+        if not isinstance(selected_columns, list):
+            return None
+        selected_columns = [str(col).strip() for col in selected_columns if str(col).strip()]
+        filter_data = plan.get("filter")
+        try:
+            compile_select(selected_columns, filter_data)
+        except FilterError:
+            return None
+
+    return {
+        "route": route,
+        "candidate_names": names,
+        "select": selected_columns,
+        "filter": filter_data,
+    }
+
+
+# --- Helper: get candidate_ids from SQL search ---
+def get_candidate_ids_by_name(name_query):
+    """
+    Candidate ids whose name or email best matches name_query, from the
+    in-memory name index (typos and partial names included).
+    """
+    candidate_rows = get_candidate_rows()
+    with tracing.span("names.lookup") as span:
+        span.set(reindexed=name_index.sync(candidate_rows))
+        candidate_ids = name_index.lookup(name_query)
+        span.set(matches=len(candidate_ids))
+        return candidate_ids
+
+
+def embed_query(query):
+    if RETRIEVAL_MODE == "keyword":
+        return None
+    with tracing.span("embed"):
+        return embed_text(normalize_query(query))
+
+
+#---- Vector search without filtering-----
+def search_vector(query, shown=(), page_size=None):
+    return _search_vector_page(query, None, shown, page_size)
+
+# --- Extract candidate name from query using LLM ---
+def extract_candidate_name(query: str) -> str:
+    return cached_llm_call("candidate_name", query, lambda: _extract_candidate_name(query))
+
+
+def _extract_candidate_name(query: str) -> str:
+    prompt = f"""
+        Extract only the candidate's full name from the following query.  
+        If there is no name, respond with an empty string.
+
+        Query: "{query}"
+        Candidate Name:
+        """
+    response = client.chat.completions.create(
+        model="gpt-4o-mini",
+        messages=[
+            {"role": "system", "content": "You extract candidate names from queries."},
+            {"role": "user", "content": prompt},
+        ],
+        temperature=0,
+    )
+    tracing.record_usage(response.usage)
+    name = response.choices[0].message.content.strip()
+    return name
+
+
+# --- Vector search filtered by candidate_id ---
+def search_vector_for_candidates(query, candidate_ids, shown=(), page_size=None):
+    if not candidate_ids:
+        # fallback: no filter
+        return search_vector(query, shown, page_size)
+    return _search_vector_page(query, candidate_ids, shown, page_size)
+
+
+# Pages after the first are cut from one ranking this many candidates deep,
+# which also bounds how far a client can page
+VECTOR_MAX_RESULTS = int(os.getenv("VECTOR_MAX_RESULTS", "50"))
+
+
+def _search_vector_page(query, candidate_ids, shown, page_size):
+    """
+    The next page_size (VECTOR_TOP_K by default) candidates not in `shown`,
+    as a Page. The first page searches just one candidate deeper than
+    itself. Later pages re-run the search at a fixed VECTOR_MAX_RESULTS
+    depth, which gives the same ranking every time, and skip the candidates
+    already shown, so no candidate repeats.
+    """
+    page_size = page_size or VECTOR_TOP_K
+    shown = [str(cid) for cid in shown]
+    depth = VECTOR_MAX_RESULTS if shown else page_size + 1
+    query_vector = embed_query(query)
+    attributes = {"mode": RETRIEVAL_MODE, "shown": len(shown)}
+    if candidate_ids:
+        attributes["filter_ids"] = len(candidate_ids)
+    with tracing.span("vector.search", **attributes) as span:
+        hits = vector_backend.search(
+            query, query_vector, candidate_ids=candidate_ids,
+            k=depth * CHUNKS_PER_CANDIDATE, mode=RETRIEVAL_MODE,
+        )
+        span.set(hits=len(hits))
+    skip = set(shown)
+    remaining = [
+        result for result in group_by_candidate(hits, depth, how=CHUNK_AGGREGATION)
+        if str(result["candidate_id"]) not in skip
+    ]
+    page = remaining[:page_size]
+
+    cursor = None
+    shown = shown + [str(result["candidate_id"]) for result in page]
+    if len(remaining) > page_size and len(shown) < VECTOR_MAX_RESULTS:
+        cursor = {
+            "branch": "vector",
+            "query": query,
+            "candidate_ids": list(candidate_ids or []),
+            "shown": shown,
+        }
+    return Page(page, cursor)
+
+
+# ===== SQL Search =====
+def search_sql(query):
+    sql_plan = generate_sql_plan(query)
+    tracing.set_attributes(sql_plan=json.dumps(sql_plan))
+
+    if not sql_plan:
+        return [{"error": "Failed to parse LLM response"}]
+    return run_sql_plan(sql_plan["select"], sql_plan["filter"])
+
+
+def generate_sql_plan(query):
+    """
+    Asks the LLM for the SELECT columns and row filter of a query.
+    Returns {"select": [...], "filter": {...}}, or None if the output can't be parsed.
+    """
+    return cached_llm_call("sql_plan.v2", query, lambda: _generate_sql_plan(query))
+
+
+def _generate_sql_plan(query):
+    sql_prompt = f"""
+        You are an expert SQL generator for the 'candidates' table with columns:
+        candidate_id, name, location, email, status.
+
+        For this natural language query, output a JSON object with two keys:
+
+        "select": list of the columns the user is requesting.
+        "filter": a filter selecting the candidates the query is about.
+        {FILTER_FORMAT}
+        Query: "{query}"
+    """
+
+    response = client.chat.completions.create(
+        model="gpt-4o-mini",
+        messages=[
+            {"role": "system", "content": "You are a SQL query generator that returns JSON only."},
+            {"role": "user", "content": sql_prompt}
+        ],
+        temperature=0,
+        response_format={"type": "json_object"},
+    )
+    tracing.record_usage(response.usage)
+    response_text = response.choices[0].message.content
+
+    try:
+        sql_plan = json.loads(response_text)
+    except (TypeError, json.JSONDecodeError):
+        return None
+    if not isinstance(sql_plan, dict) or "select" not in sql_plan:
+        return None
+
+    selected_columns = sql_plan["select"]
+    if isinstance(selected_columns, str):
+        selected_columns = [col.strip() for col in selected_columns.split(",")]
+    return {"select": selected_columns, "filter": sql_plan.get("filter")}
+
+
+# The candidates table is small: plans the in-memory snapshot can evaluate
+# skip the database round trip
+SQL_FROM_SNAPSHOT = os.getenv("SQL_FROM_SNAPSHOT", "true").strip().lower() != "false"
+SQL_PAGE_SIZE = int(os.getenv("SQL_PAGE_SIZE", "50"))
+# Row-limit syntax for pages: "sqlserver" (Azure SQL) or "sqlite"
+SQL_DIALECT = os.getenv("SQL_DIALECT", "sqlserver").strip().lower()
+if SQL_DIALECT not in PAGE_CLAUSES:
+    SQL_DIALECT = "sqlserver"
+
+
+def run_sql_plan(selected_columns, filter_data, after_id=0, page_size=None):
+    """
+    Compiles SELECT columns and a structured filter into a parameterized
+    statement and runs it against the candidates table, or answers it from
+    the candidate snapshot when the snapshot can evaluate the filter.
+    Returns one Page of up to page_size rows (SQL_PAGE_SIZE by default) with
+    candidate_id above after_id, in candidate_id order.
+    """
+    page_size = page_size or SQL_PAGE_SIZE
+    try:
+        # Validated before keyset paging adds candidate_id, whether or not it was asked for
+        columns = list(parse_columns(selected_columns))
+        if "candidate_id" not in columns:
+            columns.append("candidate_id")
+        # One row past the page tells whether another page follows
+        sql, params = compile_page(columns, filter_data, after_id, page_size + 1, SQL_DIALECT)
+    except FilterError as e:
+        return [{"error": f"Invalid SQL plan: {e}"}]
+
+    rows = None
+    if SQL_FROM_SNAPSHOT and candidate_snapshot is not None:
+        with tracing.span("sql.snapshot") as span:
+            rows = candidate_snapshot.select(
+                columns, parse_filter(filter_data), after_id=after_id, limit=page_size + 1
+            )
+            span.set(served=rows is not None, rows=len(rows or ()))
+
+    if rows is None:
+        def fetch(cursor):
+            cursor.execute(sql, params)
+            return cursor.fetchall()
+
+        with tracing.span("sql.query", statement=sql, after_id=after_id) as span:
+            rows = sql_pool.run(fetch)
+            span.set(rows=len(rows))
+
+    cursor = None
+    if len(rows) > page_size:
+        rows = rows[:page_size]
+        cursor = {
+            "branch": "sql",
+            "select": list(selected_columns),
+            "filter": filter_data,
+            "after_id": rows[-1][columns.index("candidate_id")],
+        }
+
+    # Build response dicts dynamically based on selected columns
+    return Page(
+        ({col: row[idx] for idx, col in enumerate(selected_columns)} for row in rows), cursor
+    )
+
+
+# --- Pagination ---
+class Page(list):
+    """
+    One page of branch results. `cursor` is a JSON-ready dict that next_page
+    turns into the page after it, or None on the last page.
+    """
+
+    def __init__(self, items=(), cursor=None):
+        super().__init__(items)
+        self.cursor = cursor
+
+
+def next_page(cursor):
+    """
+    The page after the one `cursor` came with. Cursors can come back from API
+    clients, so anything malformed raises ValueError.
+    """
+    if not isinstance(cursor, dict):
+        raise ValueError("Invalid cursor")
+    if cursor.get("branch") == "sql" and isinstance(cursor.get("after_id"), int):
+        return run_sql_plan(cursor.get("select") or [], cursor.get("filter"), after_id=cursor["after_id"])
+    if (
+        cursor.get("branch") == "vector"
+        and isinstance(cursor.get("query"), str)
+        and isinstance(cursor.get("shown"), list)
+        and isinstance(cursor.get("candidate_ids"), list)
+    ):
+        if len(cursor["shown"]) >= VECTOR_MAX_RESULTS:
+            raise ValueError(f"Cursor is past the last page ({VECTOR_MAX_RESULTS} results)")
+        candidate_ids = [str(cid) for cid in cursor["candidate_ids"]]
+        return join_candidate_rows(
+            search_vector_for_candidates(cursor["query"], candidate_ids, shown=cursor["shown"])
+        )
+    raise ValueError("Invalid cursor")
+
+
+def iter_pages(page):
+    """Yields page and each page after it, fetching the next one only when asked for."""
+    while True:
+        yield page
+        cursor = getattr(page, "cursor", None)
+        if not cursor:
+            return
+        page = next_page(cursor)
+
+
+def iter_results(page):
+    """Every result from page onwards, holding one page in memory at a time."""
+    for each in iter_pages(page):
+        yield from each
+
+# --- LLM answer synthesis ---
+# Token budgets for each source in the synthesis prompt
+CONTEXT_SQL_TOKENS = int(os.getenv("CONTEXT_SQL_TOKENS", "600"))
+CONTEXT_RESUME_TOKENS = int(os.getenv("CONTEXT_RESUME_TOKENS", "1200"))
+
+
+def build_context(user_query, sql_results, vector_results):
+    with tracing.span("context") as span:
+        context = build_synthesis_context(
+            user_query, sql_results, vector_results,
+            sql_budget=CONTEXT_SQL_TOKENS, resume_budget=CONTEXT_RESUME_TOKENS,
+        )
+        span.set(tokens=context["tokens"], tokens_saved=context["tokens_saved"])
+        return context
+
+
+def build_synthesis_messages(user_query, context):
+    prompt = f"""
+        You are an expert assistant that answers candidate queries precisely.
+
+        Candidate Info (from SQL):
+{context["sql"]}
+
+        Relevant Resume Excerpts (from semantic search):
+{context["resumes"]}
+
+        User Question: {user_query}
+
+        Based on the above, provide a concise and accurate answer focused only on the candidate(s) in question.
+        """
+    return [
+        {"role": "system", "content": "You answer candidate questions based on given data."},
+        {"role": "user", "content": prompt}
+    ]
+
+
+def synthesize_answer(user_query, sql_results, vector_results, context=None):
+    context = context or build_context(user_query, sql_results, vector_results)
+    with tracing.span("llm.synthesize"):
+        response = client.chat.completions.create(
+            model="gpt-4o-mini",
+            messages=build_synthesis_messages(user_query, context),
+            temperature=0,
+        )
+        tracing.record_usage(response.usage)
+    return response.choices[0].message.content.strip()
+
+
+def synthesize_answer_stream(user_query, sql_results, vector_results, context=None):
+    """
+    Same as synthesize_answer, but yields the answer text piece by piece as
+    the completion streams in. Token usage arrives with the last chunk and is
+    added to the caller's current span.
+    """
+    context = context or build_context(user_query, sql_results, vector_results)
+    stream = client.chat.completions.create(
+        model="gpt-4o-mini",
+        messages=build_synthesis_messages(user_query, context),
+        temperature=0,
+        stream=True,
+        stream_options={"include_usage": True},
+    )
+    for chunk in stream:
+        if chunk.usage:
+            tracing.record_usage(chunk.usage)
+        if chunk.choices and chunk.choices[0].delta.content:
+            yield chunk.choices[0].delta.content
+
+
+# --- Search branches, run concurrently for "both" queries ---
+def run_sql_branch(query, plan=None):
+    if plan:
+        return run_sql_plan(plan["select"], plan["filter"])
+    return search_sql(query)
+
+
+def run_vector_branch(query, plan=None):
+    if plan:
+        candidate_names = plan["candidate_names"]
+    else:
+        candidate_name = extract_candidate_name(query)
+        candidate_names = [candidate_name] if candidate_name else []
+
+    # Rule-based plans already resolved the names against the candidates table
+    candidate_ids = list(plan.get("candidate_ids") or []) if plan else []
+    if not candidate_ids:
+        for candidate_name in candidate_names:
+            for cid in get_candidate_ids_by_name(candidate_name):
+                if cid not in candidate_ids:
+                    candidate_ids.append(cid)
+    if candidate_ids:
+        return join_candidate_rows(search_vector_for_candidates(query, candidate_ids))
+    return join_candidate_rows(search_vector(query))
+
+
+def _run_timed(thread_init, name, fn, *args):
+    if thread_init is not None:
+        thread_init()
+    with tracing.span(f"branch.{name}") as span:
+        result = fn(*args)
+        span.set(results=len(result))
+    return result, span.duration
+
+
+def iter_search_branches(query, route, plan=None, thread_init=None):
+    """
+    Runs the SQL and vector branches needed for the route at the same time,
+    yielding (branch name, results, seconds taken) as each branch finishes.
+    A plan from plan_query lets the branches skip their own LLM calls.
+    thread_init, if given, runs first in each worker thread (app.py uses it
+    to attach the Streamlit script context).
+    """
+    branches = {}
+    if route in ["sql", "both"]:
+        branches["sql"] = run_sql_branch
+    if route in ["vector", "both"]:
+        branches["vector"] = run_vector_branch
+    if not branches:
+        return
+
+    with ThreadPoolExecutor(max_workers=len(branches)) as executor:
+        futures = {
+            # wrap() carries the current span over, so branch spans nest under it
+            executor.submit(tracing.wrap(_run_timed), thread_init, name, fn, query, plan): name
+            for name, fn in branches.items()
+        }
+        for future in as_completed(futures):
+            result, elapsed = future.result()
+            yield futures[future], result, elapsed
+
+
+def run_search_branches(query, route, plan=None, thread_init=None):
+    """
+    Runs the branches concurrently and returns (results, timings) keyed by
+    branch name once all of them are done, timings in seconds.
+    """
+    results, timings = {}, {}
+    for name, result, elapsed in iter_search_branches(query, route, plan, thread_init):
+        results[name] = result
+        timings[name] = elapsed
+    return results, timings
+
+
+# --- Whole queries ---
+def plan_route(query):
+    """
+    Picks the route for a query: the rule router first, then the LLM planner,
+    then the single-purpose route classifier.
+    Returns (route, plan or None, source) with source "rules", "planner" or "classifier".
+    """
+    plan = plan_query_fast(query)
+    if plan:
+        return plan["route"], plan, "rules"
+    if USE_QUERY_PLANNER and (plan := plan_query(query)):
+        return plan["route"], plan, "planner"
+    # Planner disabled or returned an invalid plan: use the per-step calls
+    return classify_query_llm(query), None, "classifier"
+
+
+def run_query(query, thread_init=None):
+    """
+    Runs a query end to end without a UI: route, search branches and, for
+    "both" queries, the synthesized answer. Returns a dict with the route,
+    its source, the first page of each branch's results and their timings,
+    and the answer (or None).
+    """
+    with tracing.span("query", query=query) as trace:
+        route, plan, source = plan_route(query)
+        trace.set(route=route)
+        results, timings = run_search_branches(query, route, plan, thread_init)
+        answer = None
+        if route == "both":
+            answer = synthesize_answer(query, results.get("sql", []), results.get("vector", []))
+    return {
+        "query": query,
+        "route": route,
+        "route_source": source,
+        "sql_results": results.get("sql", []),
+        "vector_results": results.get("vector", []),
+        "answer": answer,
+        "timings": timings,
+        "trace": trace,
+    }
+
+
+def result_record(outcome):
+    """run_query's result as a JSON-ready dict, with per-stage timings instead of the trace."""
+    record = {key: value for key, value in outcome.items() if key not in ("trace", "timings")}
+    # Results are first pages; next_page continues from these
+    record["sql_cursor"] = getattr(outcome["sql_results"], "cursor", None)
+    record["vector_cursor"] = getattr(outcome["vector_results"], "cursor", None)
+    record["timings_ms"] = tracing.stage_totals(outcome["trace"])
+    return record
@@ -0,0 +1,190 @@
+import re
+import threading
+
+
+CANDIDATE_COLUMNS = ["candidate_id", "name", "location", "email", "status"]
+
+# Words that ask for a column of the candidates table
+COLUMN_WORDS = {
+    "id": "candidate_id", "ids": "candidate_id",
+    "name": "name", "names": "name", "who": "name",
+    "location": "location", "locations": "location", "city": "location", "cities": "location",
+    "where": "location", "based": "location", "located": "location", "live": "location",
+    "lives": "location",
+    "email": "email", "emails": "email", "mail": "email", "contact": "email",
+    "status": "status", "statuses": "status", "stage": "status",
+}
+
+# Words that ask about resume content rather than table columns
+RESUME_WORDS = {
+    "skill", "skills", "experience", "experiences", "resume", "resumes", "cv", "background",
+    "expertise", "projects", "project", "qualifications", "certifications", "education",
+    "summary", "worked", "work", "history", "technologies", "tools", "strengths",
+}
+
+# Words that carry no meaning for the plan. Anything outside these sets, the
+# column/resume words and the vocabulary makes the router step aside.
+FILLER_WORDS = {
+    "a", "an", "the", "of", "in", "from", "at", "for", "with", "and", "or", "to", "on",
+    "candidate", "candidates", "applicant", "applicants", "people", "person", "everyone",
+    "list", "show", "give", "get", "find", "display", "tell", "me", "us", "please",
+    "all", "every", "each", "their", "his", "her", "its", "s", "is", "are", "was", "were",
+    "what", "whats", "which", "does", "do", "has", "have", "currently", "current",
+    "details", "info", "information", "about", "describe", "summarize",
+}
+
+
+def phrase_tokens(text: str):
+    """Word and punctuation tokens of lowercased text, the unit vocabulary phrases are matched in."""
+    return tuple(re.findall(r"\w+|[^\w\s]", text))
+
+
+class RuleRouter:
+    """
+    Deterministic fast path for common query shapes, e.g. "candidates in Ottawa",
+    "status of Bob Smith" or "emails of hired candidates".
+
+    The vocabulary (names, locations and statuses) comes from the candidates
+    table. A query is only planned when every word is either vocabulary, a
+    column word, a resume word or filler; otherwise plan() returns None and the
+    caller falls back to the LLM. Plans have the same shape as plan_query's
+    (with a sql_filters filter) plus, for named candidates, their `candidate_ids`.
+    """
+
+    def __init__(self):
+        self.fast_path = 0
+        self.fallbacks = 0
+        self._lock = threading.Lock()
+        self._build_lock = threading.Lock()  # one rebuild at a time; other callers wait for it
+        self._rows = None
+        self._lookup = {}       # tuple of phrase tokens -> (column, value)
+        self._max_tokens = 0
+        self._ids_by_name = {}
+
+    def update_vocabulary(self, candidate_rows):
+        """
+        Rebuilds the vocabulary from {candidate_id: row} dicts. Passing the
+        same dict object again is a no-op, so this is cheap to call per query.
+        Concurrent callers with the same new dict wait for a single rebuild.
+        """
+        if candidate_rows is self._rows:
+            return
+        with self._build_lock:
+            if candidate_rows is not self._rows:
+                self._build(candidate_rows)
+
+    def _build(self, candidate_rows):
+        phrases = {}
+        ids_by_name = {}
+        for candidate_id, row in candidate_rows.items():
+            for column in ("name", "location", "status"):
+                value = (row.get(column) or "").strip()
+                if value:
+                    phrases.setdefault(value.lower(), (column, value))
+            if row.get("name"):
+                ids_by_name.setdefault(row["name"].strip().lower(), []).append(candidate_id)
+
+        # Keyed by tokens, so queries are matched with dict lookups instead of one regex per phrase
+        lookup = {}
+        for phrase, match in phrases.items():
+            key = phrase_tokens(phrase)
+            if key:
+                lookup.setdefault(key, match)
+        max_tokens = max(map(len, lookup), default=0)
+        with self._lock:
+            self._lookup, self._ids_by_name, self._max_tokens = lookup, ids_by_name, max_tokens
+            self._rows = candidate_rows
+
+    def plan(self, query: str):
+        plan = self._match(query)
+        with self._lock:
+            if plan:
+                self.fast_path += 1
+            else:
+                self.fallbacks += 1
+        return plan
+
+    def _match(self, query: str):
+        with self._lock:
+            lookup, ids_by_name, max_tokens = self._lookup, self._ids_by_name, self._max_tokens
+        if not lookup:
+            return None
+
+        # Vocabulary phrases are found by looking up the query's token n-grams,
+        # longest first at each position, so "Quebec City" wins over "Quebec"
+        tokens = phrase_tokens(query.lower())
+        filters = {}
+        rest = []
+        i = 0
+        while i < len(tokens):
+            for n in range(min(max_tokens, len(tokens) - i), 0, -1):
+                match = lookup.get(tokens[i:i + n])
+                if match is not None:
+                    break
+            if match is None:
+                rest.append(tokens[i])
+                i += 1
+                continue
+            column, value = match
+            values = filters.setdefault(column, [])
+            if value not in values:
+                values.append(value)
+            rest.append(" ")
+            i += n
+
+        columns = []
+        resume = False
+        # Numbers and any other unknown word send the query to the LLM
+        for word in re.findall(r"\w+", " ".join(rest)):
+            if word in COLUMN_WORDS:
+                if COLUMN_WORDS[word] not in columns:
+                    columns.append(COLUMN_WORDS[word])
+            elif word in RESUME_WORDS:
+                resume = True
+            elif word not in FILLER_WORDS:
+                return None
+
+        names = filters.get("name", [])
+        if resume:
+            # Resume questions are only planned for explicitly named candidates
+            if not names or set(filters) - {"name"}:
+                return None
+            route = "both" if columns else "vector"
+        elif filters:
+            route = "sql"
+        else:
+            return None
+
+        candidate_ids = [cid for name in names for cid in ids_by_name.get(name.lower(), [])]
+        if route == "vector":
+            return {
+                "route": route, "candidate_names": names, "candidate_ids": candidate_ids,
+                "select": [], "filter": {"and": []},
+            }
+
+        conditions = []
+        for column in ("name", "location", "status"):
+            values = filters.get(column)
+            if not values:
+                continue
+            if len(values) == 1:
+                conditions.append({"column": column, "op": "=", "value": values[0]})
+            else:
+                conditions.append({"column": column, "op": "in", "value": values})
+
+        return {
+            "route": route,
+            "candidate_names": names,
+            "candidate_ids": candidate_ids,
+            "select": columns or list(CANDIDATE_COLUMNS),
+            "filter": conditions[0] if len(conditions) == 1 else {"and": conditions},
+        }
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.fast_path + self.fallbacks
+            return {
+                "fast_path": self.fast_path,
+                "fallbacks": self.fallbacks,
+                "fast_path_rate": self.fast_path / total if total else 0.0,
+            }
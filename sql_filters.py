@@ -0,0 +1,163 @@
+from collections import namedtuple
+from functools import lru_cache
+
+
+ALLOWED_COLUMNS = {"candidate_id", "name", "location", "email", "status"}
+COMPARISON_OPS = {"=", "!=", "<", "<=", ">", ">=", "like"}
+MAX_DEPTH = 8
+MAX_IN_VALUES = 1000
+
+# Predicate AST. Condition.value is a scalar, or a tuple of scalars for "in".
+Condition = namedtuple("Condition", ["column", "op", "value"])
+And = namedtuple("And", ["items"])
+Or = namedtuple("Or", ["items"])
+
+
+class FilterError(ValueError):
+    """Raised when a filter does not have a valid structure."""
+
+
+# --- JSON filter -> AST ---
+def parse_filter(data, depth=0):
+    """
+    Parses and validates a JSON filter:
+      {"column": "location", "op": "=", "value": "Calgary"}
+      {"column": "status", "op": "in", "value": ["Hired", "Interviewed"]}
+      {"and": [<filter>, ...]} / {"or": [<filter>, ...]}
+    An empty {"and": []} (or None) matches every row.
+    Raises FilterError on anything else.
+    """
+    if data is None:
+        return And(())
+    if depth > MAX_DEPTH:
+        raise FilterError("Filter is nested too deeply")
+    if not isinstance(data, dict):
+        raise FilterError(f"Filter must be an object, got {type(data).__name__}")
+
+    for key, node_type in (("and", And), ("or", Or)):
+        if key in data:
+            if len(data) != 1 or not isinstance(data[key], list):
+                raise FilterError(f"'{key}' must be the only key and hold a list")
+            return node_type(tuple(parse_filter(item, depth + 1) for item in data[key]))
+
+    if set(data) != {"column", "op", "value"}:
+        raise FilterError(f"Unexpected filter keys: {sorted(data)}")
+    column = data["column"]
+    op = str(data["op"]).strip().lower()
+    value = data["value"]
+    if not isinstance(column, str) or column not in ALLOWED_COLUMNS:
+        raise FilterError(f"Invalid column in filter: {column}")
+
+    if op == "in":
+        if not isinstance(value, list) or not value or len(value) > MAX_IN_VALUES:
+            raise FilterError(f"'in' needs a list of 1 to {MAX_IN_VALUES} values")
+        if not all(_is_scalar(v) for v in value):
+            raise FilterError("'in' values must be strings or numbers")
+        return Condition(column, op, tuple(value))
+    if op not in COMPARISON_OPS:
+        raise FilterError(f"Invalid operator in filter: {op}")
+    if not _is_scalar(value):
+        raise FilterError(f"Value for '{op}' must be a string or number")
+    return Condition(column, op, value)
+
+
+def _is_scalar(value) -> bool:
+    return isinstance(value, (str, int, float)) and not isinstance(value, bool)
+
+
+# --- AST -> parameterized SQL ---
+def _in_bucket(n: int) -> int:
+    # Round IN lists up to a power of two so list sizes share statement shapes
+    return 1 << (n - 1).bit_length()
+
+
+def filter_shape(node):
+    """
+    The node's structure without its values. Filters with the same shape
+    compile to the same SQL text.
+    """
+    if isinstance(node, Condition):
+        if node.op == "in":
+            return ("in", node.column, _in_bucket(len(node.value)))
+        return (node.op, node.column)
+    return (type(node).__name__, tuple(filter_shape(item) for item in node.items))
+
+
+def filter_params(node):
+    if isinstance(node, Condition):
+        if node.op == "in":
+            # Pad with the last value; repeating a value doesn't change the result
+            values = list(node.value)
+            return values + [values[-1]] * (_in_bucket(len(values)) - len(values))
+        return [node.value]
+    return [param for item in node.items for param in filter_params(item)]
+
+
+def _shape_sql(shape) -> str:
+    kind = shape[0]
+    if kind in ("And", "Or"):
+        if not shape[1]:
+            return "1 = 1" if kind == "And" else "1 = 0"
+        joiner = " AND " if kind == "And" else " OR "
+        return "(" + joiner.join(_shape_sql(item) for item in shape[1]) + ")"
+    if kind == "in":
+        return f"{shape[1]} IN ({', '.join('?' * shape[2])})"
+    return f"{shape[1]} {kind.upper()} ?"
+
+
+# Row limits for a page: Azure SQL (and SQL Server) or the SQLite benchmark database
+PAGE_CLAUSES = {
+    "sqlserver": "ORDER BY candidate_id OFFSET 0 ROWS FETCH NEXT ? ROWS ONLY",
+    "sqlite": "ORDER BY candidate_id LIMIT ?",
+}
+
+
+@lru_cache(maxsize=512)
+def _compile_statement(columns, shape, dialect=None) -> str:
+    sql = f"SELECT {', '.join(columns)} FROM candidates WHERE {_shape_sql(shape)}"
+    if dialect:
+        sql += f" AND candidate_id > ? {PAGE_CLAUSES[dialect]}"
+    return sql
+
+
+def parse_columns(columns):
+    """Validates a non-empty list of selectable columns. Returns them as a tuple."""
+    if not isinstance(columns, (list, tuple)):
+        raise FilterError(f"Columns must be a list, got {type(columns).__name__}")
+    columns = tuple(columns)
+    if not columns or any(not isinstance(col, str) or col not in ALLOWED_COLUMNS for col in columns):
+        raise FilterError(f"Invalid columns requested: {', '.join(map(str, columns))}")
+    return columns
+
+
+def _parse_select(columns, filter_data):
+    return parse_columns(columns), parse_filter(filter_data)
+
+
+def compile_select(columns, filter_data):
+    """
+    Compiles SELECT columns plus a JSON filter into a parameterized statement
+    with `?` placeholders. Returns (sql, params). Statement text is cached per
+    shape, so repeated query shapes reuse the same SQL (and server plan).
+    """
+    columns, node = _parse_select(columns, filter_data)
+    return _compile_statement(columns, filter_shape(node)), filter_params(node)
+
+
+def compile_page(columns, filter_data, after_id, limit, dialect="sqlserver"):
+    """
+    Like compile_select, for one page by key: at most `limit` rows with
+    candidate_id above after_id, in candidate_id order. The row limit is in
+    the statement, so the server plans for one page rather than every match.
+    """
+    if dialect not in PAGE_CLAUSES:
+        raise ValueError(f"Unknown SQL dialect: {dialect}")
+    columns, node = _parse_select(columns, filter_data)
+    if not isinstance(after_id, int) or isinstance(after_id, bool):
+        raise FilterError(f"Invalid page key: {after_id}")
+    sql = _compile_statement(columns, filter_shape(node), dialect)
+    return sql, filter_params(node) + [after_id, limit]
+
+
+def statement_cache_info():
+    return _compile_statement.cache_info()
@@ -0,0 +1,206 @@
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+
+class PoolTimeout(Exception):
+    """Raised when no connection becomes free within the acquire timeout."""
+
+
+class ConnectionPool:
+    """
+    Thread-safe pool of DB-API connections (pyodbc, sqlite3, ...).
+
+    connect is a zero-argument callable returning a new connection. For sqlite3
+    pass check_same_thread=False, since connections move between threads.
+    Connections idle for longer than health_check_interval seconds are pinged
+    with health_check_query before being handed out, and replaced if dead.
+    """
+
+    def __init__(self, connect, min_size=1, max_size=5, acquire_timeout=10.0,
+                 health_check_query="SELECT 1", health_check_interval=30.0):
+        if min_size > max_size:
+            raise ValueError("min_size cannot be larger than max_size")
+        self._connect = connect
+        self.min_size = min_size
+        self.max_size = max_size
+        self.acquire_timeout = acquire_timeout
+        self.health_check_query = health_check_query
+        self.health_check_interval = health_check_interval
+
+        self._idle = deque()  # (connection, last_used)
+        self._size = 0  # open connections, idle or checked out
+        self._cond = threading.Condition()
+
+        self.created = 0
+        self.reconnects = 0
+        self.discarded = 0
+        self.acquisitions = 0
+        self.timeouts = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+        for _ in range(min_size):
+            self._idle.append((self._open(), time.monotonic()))
+            self._size += 1
+
+    def _open(self):
+        conn = self._connect()
+        with self._cond:
+            self.created += 1
+        return conn
+
+    @staticmethod
+    def _close(conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def is_healthy(self, conn) -> bool:
+        try:
+            cur = conn.cursor()
+            try:
+                cur.execute(self.health_check_query)
+                cur.fetchall()
+            finally:
+                cur.close()
+            return True
+        except Exception:
+            return False
+
+    def acquire(self):
+        """
+        Checks out a connection, opening or replacing one as needed.
+        Raises PoolTimeout if the pool stays exhausted for acquire_timeout seconds.
+        """
+        start = time.monotonic()
+        deadline = start + self.acquire_timeout
+        conn, last_used = None, None
+        with self._cond:
+            while True:
+                if self._idle:
+                    conn, last_used = self._idle.popleft()
+                    break
+                if self._size < self.max_size:
+                    self._size += 1
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self.timeouts += 1
+                    raise PoolTimeout(
+                        f"No SQL connection available after {self.acquire_timeout}s "
+                        f"({self.max_size} in use)"
+                    )
+                self._cond.wait(remaining)
+
+        try:
+            if conn is None:
+                conn = self._open()
+            elif (time.monotonic() - last_used > self.health_check_interval
+                  and not self.is_healthy(conn)):
+                self._close(conn)
+                conn = self._open()
+                with self._cond:
+                    self.discarded += 1
+                    self.reconnects += 1
+        except Exception:
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            raise
+
+        waited = time.monotonic() - start
+        with self._cond:
+            self.acquisitions += 1
+            self.total_wait += waited
+            self.max_wait = max(self.max_wait, waited)
+        return conn
+
+    def release(self, conn, broken=False):
+        with self._cond:
+            if broken:
+                self._size -= 1
+                self.discarded += 1
+            else:
+                self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+        if broken:
+            self._close(conn)
+
+    @contextmanager
+    def connection(self):
+        conn = self.acquire()
+        broken = False
+        try:
+            yield conn
+        except Exception:
+            try:
+                conn.rollback()
+            except Exception:
+                pass
+            broken = not self.is_healthy(conn)
+            raise
+        finally:
+            self.release(conn, broken)
+
+    @contextmanager
+    def cursor(self):
+        """
+        Yields a fresh cursor on a pooled connection; both are returned on exit.
+        """
+        with self.connection() as conn:
+            cur = conn.cursor()
+            try:
+                yield cur
+            finally:
+                cur.close()
+
+    def run(self, work, retries=1):
+        """
+        Calls work(cursor) and returns its result. If the connection turns out
+        to be dead, it is dropped and work is retried on a new connection.
+        """
+        for attempt in range(retries + 1):
+            conn = self.acquire()
+            try:
+                cur = conn.cursor()
+                try:
+                    result = work(cur)
+                finally:
+                    cur.close()
+            except Exception:
+                try:
+                    conn.rollback()
+                except Exception:
+                    pass
+                healthy = self.is_healthy(conn)
+                self.release(conn, broken=not healthy)
+                if healthy or attempt == retries:
+                    raise
+                continue
+            self.release(conn)
+            return result
+
+    def close(self):
+        with self._cond:
+            while self._idle:
+                conn, _ = self._idle.popleft()
+                self._size -= 1
+                self._close(conn)
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                "size": self._size,
+                "idle": len(self._idle),
+                "in_use": self._size - len(self._idle),
+                "created": self.created,
+                "reconnects": self.reconnects,
+                "discarded": self.discarded,
+                "acquisitions": self.acquisitions,
+                "timeouts": self.timeouts,
+                "avg_wait_ms": 1000 * self.total_wait / self.acquisitions if self.acquisitions else 0.0,
+                "max_wait_ms": 1000 * self.max_wait,
+            }
@@ -1,55 +1,444 @@
 import os
 import glob
+import hashlib
+import json
+import random
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
 import openai
+import pyodbc
 from azure.search.documents import SearchClient
 from azure.core.credentials import AzureKeyCredential
 from dotenv import load_dotenv
+from embedding_cache import EmbeddingCache
+from vector_backends import write_local_index
+
+try:
+    import tiktoken
+except ImportError:  # fall back to a conservative character-based estimate
+    tiktoken = None
 
 load_dotenv()
 
 # OpenAI setup
 openai.api_key = os.getenv("OPENAI_API_KEY")
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "text-embedding-ada-002")
+# Inputs and estimated tokens per embeddings request (API limits: 2048 inputs, 300k tokens)
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "256"))
+EMBED_BATCH_MAX_TOKENS = int(os.getenv("EMBED_BATCH_MAX_TOKENS", "200000"))
+EMBED_WORKERS = int(os.getenv("EMBED_WORKERS", "4"))
+EMBED_MAX_RETRIES = int(os.getenv("EMBED_MAX_RETRIES", "6"))
+# Optional: embeddings shared with the app, so a text already embedded by either is reused
+embedding_cache_path = os.getenv("EMBEDDING_CACHE_PATH")
+embedding_cache = EmbeddingCache(
+    embedding_cache_path,
+    max_entries=int(os.getenv("EMBEDDING_CACHE_MAX_ENTRIES", "100000")),
+    dtype=os.getenv("EMBEDDING_CACHE_DTYPE", "float16").strip().lower(),
+) if embedding_cache_path else None
+
 # Azure AI Search setup
 search_endpoint = os.getenv("AZURE_SEARCH_ENDPOINT")
 search_key = os.getenv("AZURE_SEARCH_API_KEY")
 index_name = os.getenv("AZURE_SEARCH_INDEX")
+UPLOAD_BATCH_SIZE = 1000  # Azure AI Search limit on documents per indexing request
+# Serialized bytes per indexing request; the service rejects requests over 16 MB,
+# and a chunk with a 1536-float embedding is about 35 KB of JSON
+UPLOAD_BATCH_MAX_BYTES = int(os.getenv("UPLOAD_BATCH_MAX_BYTES", str(8 * 1024 * 1024)))
 
 search_client = SearchClient(endpoint=search_endpoint,
                               index_name=index_name,
                               credential=AzureKeyCredential(search_key))
 
+# Azure SQL setup, used to resolve each resume to its row in the candidates table
+server = os.getenv("server").strip()
+database = os.getenv("database").strip()
+sql_username = os.getenv("sql_username").strip()
+password = os.getenv("password").strip()
+driver = os.getenv("driver").strip()
+sql_connection_string = f"Driver={driver};Server={server};Database={database};Uid={sql_username};Pwd={password};Encrypt=yes;TrustServerCertificate=no;Connection Timeout=30;"
+
 resume_folder = os.getenv("RESUME_FOLDER")
+# Optional: also write a local index file for the app's VECTOR_BACKEND=local
+local_index_path = os.getenv("LOCAL_INDEX_PATH")
+# Content hashes, mtimes, ids and chunk embeddings of the last indexed run, keyed by file path
+manifest_path = os.getenv("INDEX_MANIFEST_PATH", "index_manifest.json")
+# Resumes are split per section into chunks of at most CHUNK_MAX_CHARS,
+# with CHUNK_OVERLAP characters repeated between consecutive chunks
+CHUNK_MAX_CHARS = int(os.getenv("CHUNK_MAX_CHARS", "800"))
+CHUNK_OVERLAP = int(os.getenv("CHUNK_OVERLAP", "120"))
+SECTION_HEADER = re.compile(
+    r"^[ \t]*(Summary|Work Experience|Experience|Skills|Education|Certifications|Projects)[ \t]*:",
+    re.IGNORECASE | re.MULTILINE,
+)
 
-def index_resumes():
-    documents = []
-    candidate_id = 1  # Starting ID
+RETRYABLE_ERRORS = (
+    openai.RateLimitError,
+    openai.APIConnectionError,
+    openai.APITimeoutError,
+    openai.InternalServerError,
+)
+
+
+# --- Token counting and batching ---
+if tiktoken is not None:
+    _encoding = tiktoken.encoding_for_model(EMBEDDING_MODEL)
+
+    def count_tokens(text: str) -> int:
+        return len(_encoding.encode(text))
+else:
+    def count_tokens(text: str) -> int:
+        return len(text) // 3 + 1
+
+
+def make_batches(texts, max_inputs=EMBED_BATCH_SIZE, max_tokens=EMBED_BATCH_MAX_TOKENS):
+    """
+    Groups text indices into batches that stay under both the per-request
+    input count and the estimated token budget.
+    """
+    batches = []
+    batch, batch_tokens = [], 0
+    for i, text in enumerate(texts):
+        tokens = count_tokens(text)
+        if batch and (len(batch) >= max_inputs or batch_tokens + tokens > max_tokens):
+            batches.append(batch)
+            batch, batch_tokens = [], 0
+        batch.append(i)
+        batch_tokens += tokens
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def make_upload_batches(documents, max_docs=UPLOAD_BATCH_SIZE, max_bytes=UPLOAD_BATCH_MAX_BYTES):
+    """
+    Splits documents into indexing requests that stay under both the
+    per-request document count and the serialized size limit.
+    """
+    batches = []
+    batch, batch_bytes = [], 0
+    for document in documents:
+        size = len(json.dumps(document).encode("utf-8"))
+        if batch and (len(batch) >= max_docs or batch_bytes + size > max_bytes):
+            batches.append(batch)
+            batch, batch_bytes = [], 0
+        batch.append(document)
+        batch_bytes += size
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+# --- Embedding requests ---
+def embed_batch(texts):
+    """
+    Embeds a batch of texts in one request, retrying with exponential backoff
+    and jitter on rate limits and transient errors.
+    Returns (embeddings in input order, tokens used).
+    """
+    for attempt in range(EMBED_MAX_RETRIES + 1):
+        try:
+            response = openai.embeddings.create(model=EMBEDDING_MODEL, input=texts)
+            break
+        except RETRYABLE_ERRORS as e:
+            if attempt == EMBED_MAX_RETRIES:
+                raise
+            delay = min(60, 2 ** attempt) + random.uniform(0, 1)
+            print(f"Embedding request failed ({type(e).__name__}), retrying in {delay:.1f}s")
+            time.sleep(delay)
+
+    data = sorted(response.data, key=lambda item: item.index)
+    return [item.embedding for item in data], response.usage.total_tokens
+
+
+def embed_texts(texts):
+    """
+    Embeds texts in token-bounded batches on a bounded worker pool and prints
+    docs/sec and tokens/sec. Repeated texts, and texts already in the
+    embedding cache, are not sent. Returns embeddings in the order of texts.
+    """
+    found = embedding_cache.get_many(EMBEDDING_MODEL, texts) if embedding_cache is not None else {}
+    missing = [text for text in dict.fromkeys(texts) if text not in found]
+    batches = make_batches(missing)
+    total_tokens = 0
+    start = time.perf_counter()
+
+    with ThreadPoolExecutor(max_workers=EMBED_WORKERS) as executor:
+        futures = [executor.submit(embed_batch, [missing[i] for i in batch]) for batch in batches]
+        for batch, future in zip(batches, futures):
+            batch_embeddings, tokens = future.result()
+            embedded = {missing[i]: embedding for i, embedding in zip(batch, batch_embeddings)}
+            found.update(embedded)
+            if embedding_cache is not None:
+                embedding_cache.put_many(EMBEDDING_MODEL, embedded.items())
+            total_tokens += tokens
+
+    elapsed = max(time.perf_counter() - start, 1e-9)
+    print(
+        f"Embedded {len(missing)} documents in {len(batches)} requests, {elapsed:.1f}s "
+        f"({len(missing) / elapsed:.1f} docs/s, {total_tokens / elapsed:.0f} tokens/s); "
+        f"{len(texts) - len(missing)} reused"
+    )
+    return [found[text] for text in texts]
+
+
+# --- Section-aware chunking ---
+def split_sections(content):
+    """
+    Splits a resume on its section headers (Summary, Work Experience, Skills, ...).
+    Text before the first header, or a resume without headers, is one section.
+    """
+    matches = list(SECTION_HEADER.finditer(content))
+    if not matches:
+        return [("Resume", content.strip())]
+
+    sections = []
+    preamble = content[:matches[0].start()].strip()
+    if preamble:
+        sections.append(("Resume", preamble))
+    for i, match in enumerate(matches):
+        end = matches[i + 1].start() if i + 1 < len(matches) else len(content)
+        sections.append((match.group(1).title(), content[match.start():end].strip()))
+    return sections
+
+
+def split_words(text, max_chars):
+    """
+    Splits text into parts of at most max_chars, at word boundaries; a single
+    word longer than max_chars is cut.
+    """
+    parts = []
+    part = ""
+    for word in text.split():
+        while len(word) > max_chars:
+            if part:
+                parts.append(part)
+                part = ""
+            parts.append(word[:max_chars])
+            word = word[max_chars:]
+        if part and len(part) + 1 + len(word) > max_chars:
+            parts.append(part)
+            part = ""
+        part = f"{part} {word}".strip()
+    if part:
+        parts.append(part)
+    return parts
+
+
+def chunk_resume(content, max_chars=CHUNK_MAX_CHARS, overlap=CHUNK_OVERLAP):
+    """
+    Chunks each section separately, packing whole paragraphs/sentences into
+    chunks of up to max_chars; longer ones are split at word boundaries. Each
+    new chunk starts with the last `overlap` characters of the previous one
+    (cut at a word boundary) when they fit.
+    Returns a list of {"section", "content"} dicts.
+    """
+    chunks = []
+    for section, text in split_sections(content):
+        pieces = []
+        for piece in re.split(r"\n\s*\n|(?<=[.!?])\s+", text):
+            piece = piece.strip()
+            if len(piece) > max_chars:
+                pieces.extend(split_words(piece, max_chars))
+            elif piece:
+                pieces.append(piece)
+        window = ""
+        for piece in pieces:
+            if window and len(window) + 1 + len(piece) > max_chars:
+                chunks.append({"section": section, "content": window})
+                tail = window[-overlap:] if overlap else ""
+                window = tail[tail.find(" ") + 1:] if " " in tail else ""
+                if len(window) + 1 + len(piece) > max_chars:
+                    window = ""
+            window = f"{window} {piece}".strip()
+        if window:
+            chunks.append({"section": section, "content": window})
+    return chunks
+
+
+# --- Resolve resumes to rows of the SQL candidates table ---
+EMAIL_PATTERN = re.compile(r"[\w.+-]+@[\w-]+(?:\.[\w-]+)+")
+
+
+def normalize_name(name: str) -> str:
+    return " ".join(name.lower().split())
+
+
+def find_email(content: str):
+    match = EMAIL_PATTERN.search(content)
+    return match.group(0).lower() if match else None
+
+
+def load_candidate_keys():
+    """
+    Loads every candidate's id, name and email in one query.
+    Returns (candidate_id by normalized name, candidate_id by lowercased email).
+    """
+    conn = pyodbc.connect(sql_connection_string)
+    try:
+        cursor = conn.cursor()
+        cursor.execute("SELECT candidate_id, name, email FROM candidates")
+        rows = cursor.fetchall()
+    finally:
+        conn.close()
+
+    by_name, by_email = {}, {}
+    for candidate_id, name, email in rows:
+        if name:
+            by_name.setdefault(normalize_name(name), str(candidate_id))
+        if email:
+            by_email.setdefault(email.strip().lower(), str(candidate_id))
+    return by_name, by_email
+
+
+def resolve_candidate_id(file_path, email, by_name, by_email):
+    """
+    Maps a resume to candidates.candidate_id, by the email in the resume first
+    and then by its file name (resumes are named after the candidate).
+    Resumes without a SQL row get a "resume-<file name>" id, so they stay
+    searchable but never match a SQL candidate_id.
+    """
+    if email and email in by_email:
+        return by_email[email]
+    stem = os.path.splitext(os.path.basename(file_path))[0]
+    if normalize_name(stem) in by_name:
+        return by_name[normalize_name(stem)]
+    return "resume-" + re.sub(r"[^a-z0-9]+", "-", stem.lower()).strip("-")
+
+
+# --- Index manifest for incremental runs ---
+def load_manifest(path):
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        manifest = json.load(f)
+    # Entries from before chunked indexing are dropped so those files are re-indexed
+    return {file_path: entry for file_path, entry in manifest.items() if "chunks" in entry}
+
+
+def save_manifest(path, manifest):
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(manifest, f)
+    os.replace(path + ".tmp", path)
+
+
+def content_hash(content: str) -> str:
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+def scan_resumes(file_paths, manifest):
+    """
+    Compares the resume folder with the manifest. Files whose size and mtime
+    are unchanged are skipped without being read; files that were touched but
+    have the same content hash only get their mtime refreshed.
+    Returns the new or changed files as (path, content, hash, stat) tuples.
+    """
+    changed = []
+    for file_path in file_paths:
+        stat = os.stat(file_path)
+        entry = manifest.get(file_path)
+        if entry and entry["mtime"] == stat.st_mtime and entry["size"] == stat.st_size:
+            continue
 
-    for file_path in glob.glob(os.path.join(resume_folder, "*.txt")):
         with open(file_path, "r", encoding="utf-8") as f:
             content = f.read()
-        print(f"Processing file: {file_path}")
+        digest = content_hash(content)
+        if entry and entry["sha256"] == digest:
+            entry["mtime"], entry["size"] = stat.st_mtime, stat.st_size
+            continue
+        changed.append((file_path, content, digest, stat))
+    return changed
+
+
+def index_resumes():
+    manifest = load_manifest(manifest_path)
+    by_name, by_email = load_candidate_keys()
+    file_paths = sorted(glob.glob(os.path.join(resume_folder, "*.txt")))
+    changed = scan_resumes(file_paths, manifest)
+    changed_paths = {file_path for file_path, _, _, _ in changed}
+    removed = sorted(set(manifest) - set(file_paths))
+    print(
+        f"Scanned {len(file_paths)} resumes in {resume_folder}: "
+        f"{len(changed)} new or changed, {len(removed)} removed"
+    )
+
+    # Chunks of removed resumes, and chunk ids a resume no longer uses, are deleted
+    stale_chunk_ids = set()
+    for file_path in removed:
+        stale_chunk_ids.update(chunk["chunk_id"] for chunk in manifest.pop(file_path)["chunks"])
 
-        # Generate embedding from OpenAI
-        embedding = openai.embeddings.create(
-            model="text-embedding-ada-002",
-            input=content
-        ).data[0].embedding
+    documents = []
+
+    # Unchanged resumes whose SQL row changed keep their embeddings under the new id
+    rekeyed = 0
+    for file_path in file_paths:
+        if file_path in changed_paths:
+            continue
+        entry = manifest[file_path]
+        candidate_id = resolve_candidate_id(file_path, entry.get("email"), by_name, by_email)
+        if candidate_id == entry["candidate_id"]:
+            continue
+        stale_chunk_ids.update(chunk["chunk_id"] for chunk in entry["chunks"])
+        entry["candidate_id"] = candidate_id
+        for n, chunk in enumerate(entry["chunks"]):
+            chunk["chunk_id"] = f"{candidate_id}-{n}"
+            documents.append({"candidate_id": candidate_id, **chunk})
+        rekeyed += 1
+    if rekeyed:
+        print(f"Moved {rekeyed} unchanged resumes to their current SQL candidate_id.")
+
+    if changed:
+        chunked = [chunk_resume(content) for _, content, _, _ in changed]
+        embeddings = iter(embed_texts([chunk["content"] for chunks in chunked for chunk in chunks]))
+
+        for (file_path, content, digest, stat), chunks in zip(changed, chunked):
+            email = find_email(content)
+            candidate_id = resolve_candidate_id(file_path, email, by_name, by_email)
+            if file_path in manifest:
+                stale_chunk_ids.update(chunk["chunk_id"] for chunk in manifest[file_path]["chunks"])
 
-        print("Embeddings are", embedding)
+            for n, chunk in enumerate(chunks):
+                chunk["chunk_id"] = f"{candidate_id}-{n}"
+                chunk["embedding"] = next(embeddings)
+                documents.append({"candidate_id": candidate_id, **chunk})
+            manifest[file_path] = {
+                "sha256": digest,
+                "mtime": stat.st_mtime,
+                "size": stat.st_size,
+                "email": email,
+                "candidate_id": candidate_id,
+                "chunks": chunks,
+            }
 
-        # Prepare document for Azure Search
-        doc = {
-            "candidate_id": str(candidate_id),
-            "content": content,           
-            "embedding": embedding
-        }
-        documents.append(doc)
-        candidate_id += 1
+    unmatched = sum(1 for entry in manifest.values() if entry["candidate_id"].startswith("resume-"))
+    if unmatched:
+        print(f"{unmatched} resumes have no row in the candidates table.")
 
     # Upload to Azure AI Search
     if documents:
-        result = search_client.upload_documents(documents)
-        print(f"Uploaded {len(result)} documents to Azure AI Search.")
+        uploaded = 0
+        for batch in make_upload_batches(documents):
+            uploaded += len(search_client.merge_or_upload_documents(batch))
+        print(f"Uploaded {uploaded} chunks to Azure AI Search.")
+
+    stale_chunk_ids -= {chunk["chunk_id"] for entry in manifest.values() for chunk in entry["chunks"]}
+    if stale_chunk_ids:
+        stale = [{"chunk_id": chunk_id} for chunk_id in sorted(stale_chunk_ids)]
+        for i in range(0, len(stale), UPLOAD_BATCH_SIZE):
+            search_client.delete_documents(stale[i:i + UPLOAD_BATCH_SIZE])
+        print(f"Deleted {len(stale)} stale chunks from Azure AI Search.")
+
+    # Only record the run once the index has been updated, so failures are retried
+    save_manifest(manifest_path, manifest)
+
+    if local_index_path and (documents or stale_chunk_ids or not os.path.exists(local_index_path + ".npy")):
+        documents = [
+            {"candidate_id": entry["candidate_id"], **chunk}
+            for entry in manifest.values()
+            for chunk in entry["chunks"]
+        ]
+        write_local_index(local_index_path, documents)
+        print(f"Wrote {len(documents)} chunks to local index {local_index_path}.")
 
 if __name__ == "__main__":
     index_resumes()
@@ -0,0 +1,43 @@
+import sqlite3
+
+import SQL_Insert_candidates_data_ as loader
+
+
+def candidate_rows(conn):
+    return conn.execute(
+        "SELECT candidate_id, name, status, email, location FROM candidates ORDER BY candidate_id"
+    ).fetchall()
+
+
+def test_loading_twice_upserts_by_email():
+    conn = sqlite3.connect(":memory:")
+    rows = [loader.normalize_row(row) for row in loader.SEED_CANDIDATES]
+    loader.load_candidates(conn, rows, batch_size=4, progress=False)
+    first = candidate_rows(conn)
+
+    changed = list(rows)
+    changed[0] = ("Bob Smith", "Hired", " Bob.Smith@Example.com ", "Toronto")
+    loader.load_candidates(conn, [loader.normalize_row(row) for row in changed], progress=False)
+    second = candidate_rows(conn)
+
+    assert len(second) == len(first) == len(rows)
+    assert second[0] == (first[0][0], "Bob Smith", "Hired", "bob.smith@example.com", "Toronto")
+    assert second[1:] == first[1:]
+
+
+def test_duplicate_emails_from_old_loads_are_removed():
+    conn = sqlite3.connect(":memory:")
+    conn.execute(
+        "CREATE TABLE candidates (candidate_id INTEGER PRIMARY KEY AUTOINCREMENT, "
+        "name TEXT, status TEXT, email TEXT, location TEXT)"
+    )
+    for _ in range(2):
+        conn.executemany(
+            "INSERT INTO candidates (name, status, email, location) VALUES (?, ?, ?, ?)",
+            loader.SEED_CANDIDATES[:3],
+        )
+    conn.commit()
+
+    loader.load_candidates(conn, [loader.normalize_row(loader.SEED_CANDIDATES[0])], progress=False)
+
+    assert [row[0] for row in candidate_rows(conn)] == [1, 2, 3]
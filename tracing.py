@@ -0,0 +1,239 @@
+import contextvars
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+
+_current_span = contextvars.ContextVar("current_span", default=None)
+_export_lock = threading.Lock()
+_exporter = {"path": None, "format": "jsonl", "service": "candidate-search"}
+
+TRACE_FORMATS = {"jsonl", "otlp"}
+
+
+class Span:
+    """
+    One timed stage of a query. Spans nest through a context variable, so a
+    span opened while another is current becomes its child, including in
+    worker threads started through `wrap`.
+    """
+
+    def __init__(self, name, parent=None, attributes=None):
+        self.name = name
+        self.parent = parent
+        self.trace_id = parent.trace_id if parent else os.urandom(16).hex()
+        self.span_id = os.urandom(8).hex()
+        self.attributes = dict(attributes or {})
+        self.children = []
+        self.error = None
+        self.start_time = time.time()
+        self._start = time.perf_counter()
+        self.duration = None
+        self._lock = threading.Lock()
+        if parent:
+            with parent._lock:
+                parent.children.append(self)
+
+    @property
+    def root(self):
+        span = self
+        while span.parent:
+            span = span.parent
+        return span
+
+    @property
+    def offset(self):
+        """Seconds between the start of the trace and the start of this span."""
+        return self.start_time - self.root.start_time
+
+    def set(self, **attributes):
+        with self._lock:
+            self.attributes.update(attributes)
+
+    def add(self, key, amount=1):
+        with self._lock:
+            self.attributes[key] = self.attributes.get(key, 0) + amount
+
+    def finish(self):
+        self.duration = time.perf_counter() - self._start
+
+    def walk(self, depth=0):
+        """Yields (depth, span) for this span and its descendants in start order."""
+        yield depth, self
+        with self._lock:
+            children = sorted(self.children, key=lambda child: child.start_time)
+        for child in children:
+            yield from child.walk(depth + 1)
+
+
+# --- Recording ---
+@contextmanager
+def span(name, **attributes):
+    """
+    Times the enclosed block as a child of the current span, or as the root
+    of a new trace. Finished root spans are exported.
+    """
+    parent = _current_span.get()
+    current = Span(name, parent, attributes)
+    token = _current_span.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        current.finish()
+        _current_span.reset(token)
+        if parent is None:
+            export(current)
+
+
+def current_span():
+    return _current_span.get()
+
+
+def set_attributes(**attributes):
+    """Sets attributes on the current span, if there is one."""
+    current = _current_span.get()
+    if current is not None:
+        current.set(**attributes)
+
+
+def add(key, amount=1):
+    """Adds to a counter attribute (e.g. tokens) on the current span, if any."""
+    current = _current_span.get()
+    if current is not None:
+        current.add(key, amount)
+
+
+def record_usage(usage):
+    """Adds an OpenAI response's token usage to the current span."""
+    if usage is None:
+        return
+    add("prompt_tokens", getattr(usage, "prompt_tokens", 0) or 0)
+    add("completion_tokens", getattr(usage, "completion_tokens", 0) or 0)
+
+
+def wrap(fn):
+    """
+    Binds fn to a copy of the caller's context, so spans it opens in another
+    thread nest under the caller's current span. Wrap once per submitted task.
+    """
+    context = contextvars.copy_context()
+    return lambda *args, **kwargs: context.run(fn, *args, **kwargs)
+
+
+# --- Export ---
+def configure(path=None, format="jsonl", service="candidate-search"):
+    """
+    Sets where finished traces are written: one JSON line per span ("jsonl"),
+    or one OTLP/JSON ExportTraceServiceRequest per trace ("otlp"), which an
+    OpenTelemetry collector can ingest. No path disables export.
+    """
+    if format not in TRACE_FORMATS:
+        raise ValueError(f"Unknown trace format: {format}")
+    _exporter.update(path=path or None, format=format, service=service)
+
+
+def span_record(s):
+    return {
+        "trace_id": s.trace_id,
+        "span_id": s.span_id,
+        "parent_id": s.parent.span_id if s.parent else None,
+        "name": s.name,
+        "start": s.start_time,
+        "duration_ms": round((s.duration or 0.0) * 1000, 3),
+        "error": s.error,
+        "attributes": s.attributes,
+    }
+
+
+def _otlp_value(value):
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": value if isinstance(value, str) else json.dumps(value, default=str)}
+
+
+def otlp_span(s):
+    start_ns = int(s.start_time * 1e9)
+    record = {
+        "traceId": s.trace_id,
+        "spanId": s.span_id,
+        "name": s.name,
+        "kind": 1,
+        "startTimeUnixNano": str(start_ns),
+        "endTimeUnixNano": str(start_ns + int((s.duration or 0.0) * 1e9)),
+        "attributes": [{"key": k, "value": _otlp_value(v)} for k, v in s.attributes.items()],
+        "status": {"code": 2, "message": s.error} if s.error else {"code": 1},
+    }
+    if s.parent:
+        record["parentSpanId"] = s.parent.span_id
+    return record
+
+
+def otlp_trace(root, service="candidate-search"):
+    return {
+        "resourceSpans": [{
+            "resource": {
+                "attributes": [{"key": "service.name", "value": {"stringValue": service}}],
+            },
+            "scopeSpans": [{
+                "scope": {"name": "tracing"},
+                "spans": [otlp_span(s) for _, s in root.walk()],
+            }],
+        }]
+    }
+
+
+def export(root):
+    path = _exporter["path"]
+    if not path:
+        return
+    if _exporter["format"] == "otlp":
+        lines = [otlp_trace(root, _exporter["service"])]
+    else:
+        lines = [span_record(s) for _, s in root.walk()]
+    with _export_lock, open(path, "a", encoding="utf-8") as f:
+        for line in lines:
+            f.write(json.dumps(line, default=str) + "\n")
+
+
+def stage_totals(root):
+    """Total milliseconds per span name in a trace."""
+    totals = {}
+    for _, s in root.walk():
+        totals[s.name] = totals.get(s.name, 0.0) + (s.duration or 0.0) * 1000
+    return {name: round(ms, 1) for name, ms in totals.items()}
+
+
+# --- Waterfall ---
+def format_waterfall(root, width=40):
+    """
+    Renders a trace as a text waterfall: one line per span with its start
+    offset, duration, a bar placed on the trace's timeline and its attributes.
+    """
+    total = root.duration or 1e-9
+    rows = list(root.walk())
+    label_width = max(len("  " * depth + s.name) for depth, s in rows)
+    lines = []
+    for depth, s in rows:
+        duration = s.duration or 0.0
+        start_col = min(int(s.offset / total * width), width - 1)
+        bar_len = max(1, round(duration / total * width))
+        bar = " " * start_col + "█" * min(bar_len, width - start_col)
+        attributes = " ".join(
+            f"{k}={v}" for k, v in s.attributes.items() if isinstance(v, (bool, int, float))
+        )
+        if s.error:
+            attributes = f"ERROR {s.error} {attributes}"
+        lines.append(
+            f"{('  ' * depth + s.name).ljust(label_width)} "
+            f"{s.offset * 1000:7.0f} ms {duration * 1000:7.0f} ms |{bar.ljust(width)}| {attributes}"
+        )
+    return "\n".join(lines)
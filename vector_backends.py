@@ -0,0 +1,390 @@
+import heapq
+import json
+import math
+import os
+import re
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from llm_cache import cosine_similarity
+
+try:
+    import hnswlib
+except ImportError:  # optional ANN index for large local corpora
+    hnswlib = None
+
+
+RETRIEVAL_MODES = {"keyword", "vector", "hybrid"}
+RRF_K = 60  # rank constant from the original RRF paper, also used by Azure AI Search
+# Fields a hit needs; without a select list the service also returns the embedding
+SEARCH_SELECT = ["chunk_id", "candidate_id", "section", "content"]
+
+
+def tokenize(text: str):
+    return re.findall(r"[a-z0-9#+.]+", text.lower())
+
+
+# --- Rank fusion ---
+def reciprocal_rank_fusion(rankings, k=RRF_K):
+    """
+    Fuses several ranked hit lists into one, scoring each document by
+    sum(1 / (k + rank)). Hits are matched on chunk_id, or candidate_id for
+    whole-resume documents.
+    """
+    fused = {}
+    scores = Counter()
+    for ranking in rankings:
+        for rank, hit in enumerate(ranking, start=1):
+            key = hit.get("chunk_id", hit["candidate_id"])
+            fused.setdefault(key, hit)
+            scores[key] += 1.0 / (k + rank)
+    return [
+        {**fused[key], "score": score}
+        for key, score in sorted(scores.items(), key=lambda item: item[1], reverse=True)
+    ]
+
+
+# --- Chunk hits -> candidate results ---
+def group_by_candidate(hits, k=3, how="max", passages_per_candidate=3):
+    """
+    Groups chunk-level hits by candidate_id and ranks candidates by the max or
+    sum of their chunk scores. Each result keeps its best passages, and
+    `content` holds just those passages rather than the whole resume.
+    """
+    grouped = {}
+    for hit in hits:
+        grouped.setdefault(hit["candidate_id"], []).append(hit)
+
+    results = []
+    for candidate_id, chunk_hits in grouped.items():
+        chunk_hits.sort(key=lambda hit: hit["score"], reverse=True)
+        scores = [hit["score"] for hit in chunk_hits]
+        passages = [
+            {"section": hit.get("section"), "content": hit["content"], "score": hit["score"]}
+            for hit in chunk_hits[:passages_per_candidate]
+        ]
+        results.append({
+            "candidate_id": candidate_id,
+            "score": sum(scores) if how == "sum" else max(scores),
+            "content": "\n...\n".join(passage["content"] for passage in passages),
+            "passages": passages,
+        })
+    results.sort(key=lambda result: result["score"], reverse=True)
+    return results[:k]
+
+
+def document_hit(doc, score):
+    hit = {"candidate_id": doc["candidate_id"], "content": doc["content"], "score": score}
+    for field in ("chunk_id", "section"):
+        if field in doc:
+            hit[field] = doc[field]
+    return hit
+
+
+# --- Backend interface ---
+class VectorBackend:
+    """
+    Interface for resume retrieval backends.
+
+    search() returns up to k hits as {"candidate_id", "content", "score"} dicts,
+    best first. mode is "keyword", "vector" or "hybrid" (vector + keyword with
+    RRF fusion); vector modes need query_vector. candidate_ids, when given,
+    restricts the search to those candidates.
+    For chunked indexes each hit is one chunk and also carries chunk_id and
+    section; use group_by_candidate to fold them back into candidates.
+    """
+
+    def search(self, query, query_vector=None, candidate_ids=None, k=3, mode="hybrid"):
+        raise NotImplementedError
+
+
+# --- Candidate filters for Azure AI Search ---
+def candidate_filter(candidate_ids, eq_max=4):
+    """
+    OData filter restricting a search to candidate_ids: a short `eq` chain for a
+    few ids, a single search.in() set-membership test for more.
+    """
+    ids = list(dict.fromkeys(str(cid).replace("'", "''") for cid in candidate_ids))
+    if len(ids) <= eq_max:
+        return " or ".join(f"candidate_id eq '{cid}'" for cid in ids)
+    # candidate_ids are SQL ids or "resume-<slug>" keys, so they never contain commas
+    return f"search.in(candidate_id, '{','.join(ids)}', ',')"
+
+
+class AzureSearchBackend(VectorBackend):
+    """
+    Azure AI Search index with `chunk_id` (key), `candidate_id`, `section`,
+    `content` and an `embedding` vector field. Hybrid queries are fused with
+    RRF by the service itself.
+
+    Candidate sets up to in_filter_max ids go into one filter. Larger sets are
+    split into chunks that are queried in parallel and merged by score; hybrid
+    queries then merge the vector and keyword rankings separately and fuse them
+    with RRF locally, as the service would for a single query.
+    """
+
+    def __init__(self, search_client, vector_field="embedding",
+                 eq_filter_max=4, in_filter_max=1000, max_workers=4):
+        self.search_client = search_client
+        self.vector_field = vector_field
+        self.eq_filter_max = eq_filter_max
+        self.in_filter_max = in_filter_max
+        self.max_workers = max_workers
+
+    def search(self, query, query_vector=None, candidate_ids=None, k=3, mode="hybrid"):
+        ids = list(dict.fromkeys(str(cid) for cid in candidate_ids)) if candidate_ids else []
+        if len(ids) <= self.in_filter_max:
+            filter_expr = candidate_filter(ids, self.eq_filter_max) if ids else None
+            return self._search(query, query_vector, filter_expr, k, mode)
+
+        chunks = [ids[i:i + self.in_filter_max] for i in range(0, len(ids), self.in_filter_max)]
+        if mode == "hybrid":
+            # The vector leg is k deep, as k_nearest_neighbors=k is in a single query
+            depth = max(k * 5, 50)
+            fused = reciprocal_rank_fusion([
+                self._search_chunks(query, query_vector, chunks, k, "vector"),
+                self._search_chunks(query, query_vector, chunks, depth, "keyword"),
+            ])
+            return fused[:k]
+        return self._search_chunks(query, query_vector, chunks, k, mode)
+
+    def _search_chunks(self, query, query_vector, chunks, k, mode):
+        def search_chunk(chunk):
+            return self._search(query, query_vector, candidate_filter(chunk, self.eq_filter_max), k, mode)
+
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(chunks))) as executor:
+            hits = [hit for chunk_hits in executor.map(search_chunk, chunks) for hit in chunk_hits]
+        hits.sort(key=lambda hit: hit["score"], reverse=True)
+        return hits[:k]
+
+    def _search(self, query, query_vector, filter_expr, k, mode):
+        kwargs = {"top": k, "select": SEARCH_SELECT}
+        if filter_expr:
+            kwargs["filter"] = filter_expr
+
+        if mode in ("vector", "hybrid"):
+            from azure.search.documents.models import VectorizedQuery
+
+            kwargs["vector_queries"] = [
+                VectorizedQuery(vector=query_vector, k_nearest_neighbors=k, fields=self.vector_field)
+            ]
+            if filter_expr:
+                kwargs["vector_filter_mode"] = "preFilter"
+
+        search_text = query if mode in ("keyword", "hybrid") else None
+        results = self.search_client.search(search_text=search_text, **kwargs)
+        return [
+            {
+                "chunk_id": r.get("chunk_id"),
+                "candidate_id": r["candidate_id"],
+                "section": r.get("section"),
+                "content": r["content"],
+                "score": r["@search.score"],
+            }
+            for r in results
+        ]
+
+
+# --- BM25 ---
+def bm25_postings(documents, k1=1.5, b=0.75):
+    """
+    Inverted index {term: (rows, weights)} over the documents' content, where
+    weights are each row's BM25 score for the term. A query's score for a
+    document is the sum of its terms' weights.
+    """
+    term_counts = [Counter(tokenize(doc["content"])) for doc in documents]
+    lengths = [sum(counts.values()) for counts in term_counts]
+    avg_length = sum(lengths) / len(lengths) if lengths else 0.0
+    postings = {}
+    for i, counts in enumerate(term_counts):
+        norm = k1 * (1 - b + b * lengths[i] / avg_length)
+        for term, tf in counts.items():
+            postings.setdefault(term, []).append((i, tf * (k1 + 1) / (tf + norm)))
+
+    n = len(documents)
+    index = {}
+    for term, entries in postings.items():
+        idf = math.log(1 + (n - len(entries) + 0.5) / (len(entries) + 0.5))
+        index[term] = ([i for i, _ in entries], [idf * weight for _, weight in entries])
+    return index
+
+
+class InMemoryBackend(VectorBackend):
+    """
+    Pure-Python index over a list of {"candidate_id", "content", "embedding"}
+    documents (optionally with chunk_id and section). Keyword ranking uses BM25 and vector ranking cosine similarity.
+    Meant for small corpora and for exercising retrieval without Azure.
+    """
+
+    def __init__(self, documents, k1=1.5, b=0.75):
+        self.documents = list(documents)
+        self.k1 = k1
+        self.b = b
+        self._postings = bm25_postings(self.documents, k1, b)
+
+    def _candidate_rows(self, candidate_ids):
+        """Set of the candidates' rows, or None for every row."""
+        if not candidate_ids:
+            return None
+        allowed = {str(cid) for cid in candidate_ids}
+        return {i for i, doc in enumerate(self.documents) if str(doc["candidate_id"]) in allowed}
+
+    def _hit(self, i, score):
+        return document_hit(self.documents[i], score)
+
+    def keyword_ranking(self, query, rows, depth):
+        # Only documents in the query terms' postings can score above zero
+        scores = Counter()
+        for term in tokenize(query):
+            for i, weight in zip(*self._postings.get(term, ((), ()))):
+                scores[i] += weight
+        scored = [(score, i) for i, score in scores.items() if rows is None or i in rows]
+        return [self._hit(i, score) for score, i in heapq.nlargest(depth, scored)]
+
+    def vector_ranking(self, query_vector, rows, depth):
+        if rows is None:
+            rows = range(len(self.documents))
+        scored = [(cosine_similarity(query_vector, self.documents[i]["embedding"]), i) for i in rows]
+        scored.sort(reverse=True)
+        return [self._hit(i, score) for score, i in scored[:depth]]
+
+    def search(self, query, query_vector=None, candidate_ids=None, k=3, mode="hybrid"):
+        rows = self._candidate_rows(candidate_ids)
+        if mode == "keyword":
+            return self.keyword_ranking(query, rows, k)
+        if mode == "vector":
+            return self.vector_ranking(query_vector, rows, k)
+        # Fuse deeper lists than k so documents ranked just outside either list still count
+        depth = max(k * 5, 50)
+        fused = reciprocal_rank_fusion([
+            self.vector_ranking(query_vector, rows, depth),
+            self.keyword_ranking(query, rows, depth),
+        ])
+        return fused[:k]
+
+
+# --- Local index file, written by the indexer ---
+def write_local_index(path, documents):
+    """
+    Writes documents ({"candidate_id", "content", "embedding"}, optionally with
+    chunk_id and section) to a local index: `<path>.npy` holds the
+    L2-normalized float32 embedding matrix and `<path>.json` the matching
+    document fields per row.
+    """
+    matrix = np.asarray([doc["embedding"] for doc in documents], dtype=np.float32)
+    if len(matrix):
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        matrix /= np.where(norms == 0, 1, norms)
+    metadata = {
+        "documents": [
+            {**{key: value for key, value in doc.items() if key != "embedding"},
+             "candidate_id": str(doc["candidate_id"])}
+            for doc in documents
+        ]
+    }
+    # Write both files next to the old ones, then swap them in
+    with open(path + ".npy.tmp", "wb") as f:
+        np.save(f, matrix)
+    with open(path + ".json.tmp", "w", encoding="utf-8") as f:
+        json.dump(metadata, f)
+    os.replace(path + ".npy.tmp", path + ".npy")
+    os.replace(path + ".json.tmp", path + ".json")
+
+
+class LocalVectorBackend(VectorBackend):
+    """
+    In-process backend over a local index written by write_local_index.
+
+    Embeddings stay in a memory-mapped float32 matrix and are searched with a
+    single matrix-vector product. Candidate filters become a boolean row bitmap,
+    so only the allowed rows are scored. With ann=True and hnswlib installed,
+    unfiltered searches over corpora of at least ann_min_docs rows use an HNSW
+    graph instead of brute force.
+    """
+
+    def __init__(self, path, ann=False, ann_min_docs=50000, ef_search=64):
+        self.embeddings = np.load(path + ".npy", mmap_mode="r")
+        with open(path + ".json", "r", encoding="utf-8") as f:
+            self.documents = json.load(f)["documents"]
+
+        self._rows_by_candidate = {}
+        for i, doc in enumerate(self.documents):
+            self._rows_by_candidate.setdefault(str(doc["candidate_id"]), []).append(i)
+        # BM25 postings as arrays, so a term's weights are added to every row at once
+        self._postings = {
+            term: (np.asarray(rows, dtype=np.int64), np.asarray(weights))
+            for term, (rows, weights) in bm25_postings(self.documents).items()
+        }
+
+        self._ann = None
+        self.ef_search = ef_search
+        if ann and hnswlib is not None and len(self.documents) >= ann_min_docs:
+            self._ann = hnswlib.Index(space="ip", dim=self.embeddings.shape[1])
+            self._ann.init_index(max_elements=len(self.documents), ef_construction=200, M=16)
+            self._ann.add_items(np.asarray(self.embeddings), np.arange(len(self.documents)))
+
+    def candidate_bitmap(self, candidate_ids):
+        bitmap = np.zeros(len(self.documents), dtype=bool)
+        for cid in candidate_ids:
+            bitmap[self._rows_by_candidate.get(str(cid), [])] = True
+        return bitmap
+
+    def _hit(self, i, score):
+        return document_hit(self.documents[i], float(score))
+
+    def vector_ranking(self, query_vector, bitmap, depth):
+        q = np.asarray(query_vector, dtype=np.float32)
+        norm = np.linalg.norm(q)
+        if norm:
+            q = q / norm
+
+        if bitmap is None and self._ann is not None:
+            k = min(depth, len(self.documents))
+            self._ann.set_ef(max(self.ef_search, k))
+            labels, distances = self._ann.knn_query(q, k=k)
+            return [self._hit(i, 1 - d) for i, d in zip(labels[0], distances[0])]
+
+        rows = np.flatnonzero(bitmap) if bitmap is not None else None
+        scores = (self.embeddings[rows] if rows is not None else self.embeddings) @ q
+        k = min(depth, len(scores))
+        if k == 0:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        if rows is not None:
+            return [self._hit(rows[i], scores[i]) for i in top]
+        return [self._hit(i, scores[i]) for i in top]
+
+    def keyword_ranking(self, query, bitmap, depth):
+        scores = np.zeros(len(self.documents))
+        for term in tokenize(query):
+            postings = self._postings.get(term)
+            if postings is not None:
+                scores[postings[0]] += postings[1]  # rows are unique within a term
+        if bitmap is not None:
+            scores[~bitmap] = 0.0
+        rows = np.flatnonzero(scores)
+        k = min(depth, len(rows))
+        if k == 0:
+            return []
+        # Every row scoring at least the k-th best, so ties at the cut are all
+        # kept and then ordered by row, highest first, like InMemoryBackend
+        kth = np.partition(scores[rows], len(rows) - k)[len(rows) - k]
+        top = rows[scores[rows] >= kth]
+        top = top[np.lexsort((-top, -scores[top]))][:k]
+        return [self._hit(i, scores[i]) for i in top]
+
+    def search(self, query, query_vector=None, candidate_ids=None, k=3, mode="hybrid"):
+        bitmap = self.candidate_bitmap(candidate_ids) if candidate_ids else None
+        if mode == "keyword":
+            return self.keyword_ranking(query, bitmap, k)
+        if mode == "vector":
+            return self.vector_ranking(query_vector, bitmap, k)
+        depth = max(k * 5, 50)
+        fused = reciprocal_rank_fusion([
+            self.vector_ranking(query_vector, bitmap, depth),
+            self.keyword_ranking(query, bitmap, depth),
+        ])
+        return fused[:k]